@@ -1,29 +1,60 @@
 import os
 import json
+import time
+import threading
+import asyncio
 import logging
 import sys
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Any, List, Optional, Tuple
 
 import uvicorn
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from openai import AsyncOpenAI
-import google.generativeai as genai
+# orjson (в requirements) сериализует ответы заметно быстрее stdlib json
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
 from dotenv import load_dotenv
 
+# SDK провайдеров импортируются лениво в _setup_*_client: ненастроенный провайдер не грузится вовсе
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
 # --- Конфигурация ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Неизменяемые части пользовательского промпта
+CONTEXT_HEADER = "КОНТЕКСТ:\n---\n"
+CONTEXT_SEPARATOR = "\n---\n"
+FRAGMENT_PREFIX = "ФРАГМЕНТ ИЗ ФАЙЛА '"
+FRAGMENT_SUFFIX = "':\n"
+QUESTION_HEADER = "\n---\nВОПРОС: "
+
 class AppConfig:
     def __init__(self):
         self.script_dir = Path(__file__).parent.absolute()
         load_dotenv(self.script_dir / ".env")
         self.config = self._load_config()
         self.system_prompt = self._load_system_prompt()
+        # Gemini не принимает системный промпт отдельно — готовим префикс один раз
+        self.gemini_preamble = self.system_prompt + "\n\n"
+        # Параметры моделей читаются из окружения один раз. Приоритет: .env -> config.json -> default
+        self.default_provider = os.getenv("MODEL_PROVIDER") or self.config.get("model_provider", "openai")
+        self.openai_model = os.getenv("OPENROUTER_MODEL") or self.config.get("openai_model", "gpt-4o")
+        self.temperature = float(os.getenv("LLM_TEMPERATURE") or self.config.get("temperature", 0.1))
         self.openai_client = self._setup_openai_client()
         self.gemini_client = self._setup_gemini_client()
+        # Экземпляры GenerativeModel и GenerationConfig создаются один раз и переиспользуются
+        self.gemini_models: Dict[str, Any] = {}
+        self.gemini_generation_config = None
+        if self.gemini_client:
+            self.gemini_generation_config = self.gemini_client.types.GenerationConfig(
+                temperature=self.temperature
+            )
+            self.get_gemini_model(self.config.get("gemini_model", "gemini-1.5-flash"))
+        # Ленивые подмодули SDK догружаются в фоне, а не на первом запросе
+        threading.Thread(target=self._warm_imports, daemon=True).start()
     
     def _load_config(self) -> Dict[str, Any]:
         config_path = self.script_dir / "config.json"
@@ -31,7 +62,7 @@ class AppConfig:
             with open(config_path, "r", encoding="utf-8") as f:
                 return json.load(f)
         except (FileNotFoundError, json.JSONDecodeError) as e:
-            logger.error(f"Ошибка загрузки config.json: {e}")
+            logger.error("Ошибка загрузки config.json: %s", e)
             sys.exit(1)
     
     def _load_system_prompt(self) -> str:
@@ -40,14 +71,15 @@ class AppConfig:
             with open(prompt_path, "r", encoding="utf-8") as f:
                 return f.read().strip()
         except FileNotFoundError as e:
-            logger.error(f"Ошибка загрузки system_prompt.txt: {e}")
+            logger.error("Ошибка загрузки system_prompt.txt: %s", e)
             sys.exit(1)
     
-    def _setup_openai_client(self) -> Optional[AsyncOpenAI]:
+    def _setup_openai_client(self) -> Optional["AsyncOpenAI"]:
         # OpenRouter priority
         openrouter_key = os.getenv("OPENROUTER_API_KEY")
         if openrouter_key:
             logger.info("Используется OpenRouter API")
+            from openai import AsyncOpenAI
             return AsyncOpenAI(
                 api_key=openrouter_key,
                 base_url="https://openrouter.ai/api/v1"
@@ -58,6 +90,7 @@ class AppConfig:
         if not api_key:
             logger.warning("Переменная окружения OPENAI_API_KEY (или OPENROUTER_API_KEY) не установлена")
             return None
+        from openai import AsyncOpenAI
         return AsyncOpenAI(api_key=api_key)
     
     def _setup_gemini_client(self) -> Optional[Any]:
@@ -65,15 +98,43 @@ class AppConfig:
         if not api_key:
             logger.warning("Переменная окружения GEMINI_API_KEY не установлена")
             return None
+        import google.generativeai as genai
         genai.configure(api_key=api_key)
         return genai
 
-app_config = AppConfig()
-app = FastAPI(title="Plain Text RAG Answer Service")
+    def _warm_imports(self) -> None:
+        try:
+            if self.openai_client:
+                # Ресурсы клиента — cached_property, импортирующие свои модули при первом обращении
+                self.openai_client.chat.completions
+                self.openai_client.models
+        except Exception as e:
+            logger.warning("Не удалось заранее загрузить модули SDK: %s", e)
+
+    def get_gemini_model(self, model_name: str) -> Any:
+        model = self.gemini_models.get(model_name)
+        if model is None:
+            model = self.gemini_models[model_name] = self.gemini_client.GenerativeModel(model_name)
+        return model
+
+# Клиенты провайдеров создаются в lifespan, то есть только в процессах-воркерах uvicorn:
+# родительский процесс (python ask_question.py) лишь импортирует модуль и запросы не обслуживает
+ai_service: Optional["AIService"] = None
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    global ai_service
+    ai_service = AIService(AppConfig())
+    yield
+
+app = FastAPI(title="Plain Text RAG Answer Service", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # --- Обновленные модели данных ---
 
 class SourceChunk(BaseModel):
+    # Фрагменты только читаются; лишние поля из payload Qdrant отбрасываются без ошибок
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
     text: str
     file: str
 
@@ -87,24 +148,52 @@ class PlainTextAnswerResponse(BaseModel):
     answer: str
     model_used: str
 
+class ModelStatus(BaseModel):
+    provider: str
+    model: str
+    available: bool
+    error: Optional[str] = None
+
+# Схемы собираются при импорте, а не на первом запросе
+SourceChunk.model_rebuild()
+RAGRequest.model_rebuild()
+PlainTextAnswerResponse.model_rebuild()
+ModelStatus.model_rebuild()
+
+# Таймаут проверки провайдера и время жизни закэшированного статуса, сек.
+MODEL_CHECK_TIMEOUT = 2.0
+MODEL_STATUS_TTL = 30.0
+
 # --- Логика API ---
 
 class AIService:
     def __init__(self, config: AppConfig):
         self.config = config
+        self._model_status: List[ModelStatus] = []
+        self._model_status_checked_at = 0.0
     
-    def _build_user_prompt(self, question: str, context: List[SourceChunk]) -> str:
-        context_parts = [f"ФРАГМЕНТ ИЗ ФАЙЛА '{chunk.file}':\n{chunk.text}" for chunk in context]
-        formatted_context = "\n---\n".join(context_parts)
-        return f"КОНТЕКСТ:\n---\n{formatted_context}\n---\nВОПРОС: {question}"
+    def _build_user_prompt(self, question: str, context: List[SourceChunk], preamble: str = "") -> str:
+        # Промпт собирается одним join без промежуточных строк на каждый фрагмент
+        parts = [preamble, CONTEXT_HEADER]
+        for i, chunk in enumerate(context):
+            if i:
+                parts.append(CONTEXT_SEPARATOR)
+            parts += (FRAGMENT_PREFIX, chunk.file, FRAGMENT_SUFFIX, chunk.text)
+        parts += (QUESTION_HEADER, question)
+        return "".join(parts)
     
+    def _openai_settings(self) -> Tuple[str, float]:
+        return self.config.openai_model, self.config.temperature
+
+    def _resolve_provider(self, request: RAGRequest) -> str:
+        # Приоритет: запрос -> .env -> config.json -> default
+        return request.model_provider or self.config.default_provider
+
     async def _generate_openai_answer(self, question: str, context: List[SourceChunk]) -> tuple[str, str]:
         if not self.config.openai_client:
             raise HTTPException(status_code=500, detail="OpenAI/OpenRouter клиент не настроен.")
         
-        # Приоритет env vars
-        model_name = os.getenv("OPENROUTER_MODEL") or self.config.config.get("openai_model", "gpt-4o")
-        temperature = float(os.getenv("LLM_TEMPERATURE") or self.config.config.get("temperature", 0.1))
+        model_name, temperature = self._openai_settings()
         
         user_prompt = self._build_user_prompt(question, context)
         
@@ -121,7 +210,7 @@ class AIService:
             answer = response.choices[0].message.content
             return answer.strip(), model_name
         except Exception as e:
-            logger.error(f"Ошибка при обращении к OpenAI/OpenRouter: {e}")
+            logger.error("Ошибка при обращении к OpenAI/OpenRouter: %s", e)
             raise HTTPException(status_code=500, detail="Ошибка обработки запроса OpenAI/OpenRouter.")
 
     async def _generate_gemini_answer(self, question: str, context: List[SourceChunk]) -> tuple[str, str]:
@@ -129,25 +218,76 @@ class AIService:
             raise HTTPException(status_code=500, detail="Gemini клиент не настроен.")
             
         model_name = self.config.config.get("gemini_model", "gemini-1.5-flash")
-        user_prompt = self._build_user_prompt(question, context)
-        full_prompt = f"{self.config.system_prompt}\n\n{user_prompt}"
+        full_prompt = self._build_user_prompt(question, context, self.config.gemini_preamble)
         
         try:
-            model = self.config.gemini_client.GenerativeModel(model_name)
+            model = self.config.get_gemini_model(model_name)
             response = await model.generate_content_async(
                 full_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=self.config.config.get("temperature", 0.1)
-                )
+                generation_config=self.config.gemini_generation_config
             )
             return response.text.strip(), model_name
         except Exception as e:
-            logger.error(f"Ошибка при обращении к Gemini: {e}")
+            logger.error("Ошибка при обращении к Gemini: %s", e)
             raise HTTPException(status_code=500, detail="Ошибка обработки запроса Gemini.")
 
+    async def _stream_openai_answer(self, question: str, context: List[SourceChunk], model_name: str, temperature: float) -> AsyncIterator[str]:
+        user_prompt = self._build_user_prompt(question, context)
+        
+        try:
+            stream = await self.config.openai_client.chat.completions.create(
+                model=model_name,
+                messages=[
+                    {"role": "system", "content": self.config.system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=temperature,
+                stream=True,
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            # Заголовки уже отправлены: обрываем поток, чтобы клиент не принял частичный ответ за полный
+            logger.error("Ошибка при потоковом обращении к OpenAI/OpenRouter: %s", e)
+            raise
+
+    async def _stream_gemini_answer(self, question: str, context: List[SourceChunk], model_name: str) -> AsyncIterator[str]:
+        full_prompt = self._build_user_prompt(question, context, self.config.gemini_preamble)
+        
+        try:
+            model = self.config.get_gemini_model(model_name)
+            response = await model.generate_content_async(
+                full_prompt,
+                generation_config=self.config.gemini_generation_config,
+                stream=True,
+            )
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            logger.error("Ошибка при потоковом обращении к Gemini: %s", e)
+            raise
+
+    def stream_answer(self, request: RAGRequest) -> Tuple[AsyncIterator[str], str]:
+        """Проверяет провайдера до начала потока и возвращает генератор фрагментов ответа и имя модели."""
+        provider = self._resolve_provider(request)
+        
+        if provider in ["openai", "openrouter"]:
+            if not self.config.openai_client:
+                raise HTTPException(status_code=500, detail="OpenAI/OpenRouter клиент не настроен.")
+            model_name, temperature = self._openai_settings()
+            return self._stream_openai_answer(request.question, request.context, model_name, temperature), model_name
+        elif provider == "gemini":
+            if not self.config.gemini_client:
+                raise HTTPException(status_code=500, detail="Gemini клиент не настроен.")
+            model_name = self.config.config.get("gemini_model", "gemini-1.5-flash")
+            return self._stream_gemini_answer(request.question, request.context, model_name), model_name
+        else:
+            raise HTTPException(status_code=400, detail=f"Неподдерживаемый провайдер модели: {provider}")
+
     async def generate_answer(self, request: RAGRequest) -> PlainTextAnswerResponse:
-        # Приоритет: запрос -> .env -> config.json -> default
-        provider = request.model_provider or os.getenv("MODEL_PROVIDER") or self.config.config.get("model_provider", "openai")
+        provider = self._resolve_provider(request)
         
         if provider in ["openai", "openrouter"]:
             answer_text, model_name = await self._generate_openai_answer(request.question, request.context)
@@ -156,13 +296,69 @@ class AIService:
         else:
             raise HTTPException(status_code=400, detail=f"Неподдерживаемый провайдер модели: {provider}")
         
-        return PlainTextAnswerResponse(answer=answer_text, model_used=model_name)
+        # Данные сформированы сервисом, повторная валидация не нужна
+        return PlainTextAnswerResponse.model_construct(answer=answer_text, model_used=model_name)
 
-ai_service = AIService(app_config)
+    async def _check_openai(self) -> ModelStatus:
+        status = ModelStatus(provider="openai", model=self.config.openai_model, available=False)
+        if not self.config.openai_client:
+            status.error = "Клиент не настроен."
+            return status
+        try:
+            await asyncio.wait_for(self.config.openai_client.models.list(), MODEL_CHECK_TIMEOUT)
+            status.available = True
+        except Exception as e:
+            status.error = str(e) or type(e).__name__
+        return status
+
+    async def _check_gemini(self) -> ModelStatus:
+        model_name = self.config.config.get("gemini_model", "gemini-1.5-flash")
+        status = ModelStatus(provider="gemini", model=model_name, available=False)
+        if not self.config.gemini_client:
+            status.error = "Клиент не настроен."
+            return status
+        try:
+            # SDK Gemini синхронный — проверяем в отдельном потоке
+            await asyncio.wait_for(
+                asyncio.to_thread(lambda: next(iter(self.config.gemini_client.list_models(page_size=1)), None)),
+                MODEL_CHECK_TIMEOUT
+            )
+            status.available = True
+        except Exception as e:
+            status.error = str(e) or type(e).__name__
+        return status
+
+    async def get_model_status(self) -> List[ModelStatus]:
+        """Проверяет провайдеров параллельно; результат кэшируется на MODEL_STATUS_TTL секунд."""
+        now = time.monotonic()
+        if self._model_status and now - self._model_status_checked_at < MODEL_STATUS_TTL:
+            return self._model_status
+        self._model_status = list(await asyncio.gather(self._check_openai(), self._check_gemini()))
+        self._model_status_checked_at = now
+        return self._model_status
 
 @app.post("/generate_answer", response_model=PlainTextAnswerResponse)
 async def generate_answer_endpoint(request: RAGRequest):
     return await ai_service.generate_answer(request)
 
+@app.get("/models", response_model=List[ModelStatus])
+async def get_available_models():
+    return await ai_service.get_model_status()
+
+@app.post("/generate_answer_stream")
+async def generate_answer_stream_endpoint(request: RAGRequest):
+    chunks, model_name = ai_service.stream_answer(request)
+    return StreamingResponse(chunks, media_type="text/plain; charset=utf-8", headers={"X-Model-Used": model_name})
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Для workers > 1 uvicorn нужна строка импорта приложения, а не сам объект
+    uvicorn.run(
+        "ask_question:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        # Keep-alive дольше, чем у клиентов (rag-chat — 60 с, rag-yandex-bot — 75 с): сервер не рвет соединение первым
+        timeout_keep_alive=90,
+        workers=int(os.getenv("RAG_BOT_WORKERS", 4))
+    )
@@ -0,0 +1,92 @@
+"""
+Микробатчинг одновременных асинхронных вызовов.
+
+Запросы из одновременных обработчиков копятся короткое окно и обслуживаются одним пакетным вызовом.
+Копия rag-yandex-bot/batcher.py (у каждого сервиса свой Docker-контекст сборки); код обеих копий держать одинаковым.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Объединяет одновременные вызовы submit() в пакетные вызовы обработчика."""
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        window: float,
+        max_batch: int,
+        max_in_flight: Optional[int] = None,
+        split_on_error: bool = False
+    ):
+        """
+        handler — асинхронная функция: список входов -> список результатов в том же порядке;
+        window — сколько секунд ждать новых элементов перед отправкой батча;
+        max_batch — максимум элементов в одном вызове обработчика;
+        max_in_flight — максимум одновременных вызовов обработчика (None — без ограничения);
+        split_on_error — при ошибке батча повторить элементы по одному, чтобы ошибку получил только виновный.
+        """
+        self._handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self._in_flight = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self.split_on_error = split_on_error
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # Сильные ссылки на выполняющиеся батчи, чтобы сборщик мусора не удалил задачи посреди вызова
+        self._batch_tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Ставит элемент в следующий батч и ждет его результат; исключения обработчика пробрасываются."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                await asyncio.sleep(self.window)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                # Батч уходит отдельной задачей: элементы, пришедшие во время вызова, не ждут его завершения
+                task = asyncio.create_task(self._run(batch))
+                self._batch_tasks.add(task)
+                task.add_done_callback(self._batch_tasks.discard)
+        except asyncio.CancelledError:
+            # Не оставляем ожидающих без ответа, если сборщик батчей был отменен при остановке
+            for _, future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            raise
+
+    async def _call(self, items: List[Any]) -> List[Any]:
+        if self._in_flight is None:
+            return await self._handler(items)
+        async with self._in_flight:
+            return await self._handler(items)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        try:
+            results = await self._call([item for item, _ in batch])
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            if self.split_on_error and len(batch) > 1:
+                logger.warning(f"Batched call failed for {len(batch)} items, retrying one by one: {e}")
+                await asyncio.gather(*(self._run([entry]) for entry in batch))
+                return
+            logger.error(f"Batched call failed for {len(batch)} items: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,158 @@
+"""
+Кэши rag-chat.
+
+AnswerCache — ответы RAG: точное совпадение по нормализованному тексту вопроса и
+семантическое совпадение по косинусной близости эмбеддингов вопросов.
+TTLCache — короткоживущий кэш результатов поиска в Qdrant.
+
+embedding_key, normalize_question, question_key и TTLCache продублированы в
+rag-yandex-bot/cache.py (у каждого сервиса свой Docker-контекст сборки); код обеих копий держать одинаковым.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def embedding_key(embedding: List[float]) -> bytes:
+    """Ключ эмбеддинга; округление до float16 склеивает векторы, отличающиеся шумом в младших разрядах."""
+    return hashlib.blake2b(np.asarray(embedding, dtype=np.float16).tobytes(), digest_size=16).digest()
+
+
+def normalize_question(question: str) -> str:
+    """Приводит вопрос к каноническому виду: регистр и повторяющиеся пробелы не важны."""
+    return " ".join(question.split()).casefold()
+
+
+def question_key(question: str) -> bytes:
+    """Ключ фиксированной длины по нормализованному тексту вопроса."""
+    return hashlib.blake2b(normalize_question(question).encode("utf-8"), digest_size=16).digest()
+
+
+class AnswerCache:
+    """
+    LRU-кэш ответов с TTL.
+
+    Эмбеддинги вопросов хранятся нормированными в строках одной матрицы float32,
+    поэтому семантический поиск — одно матрично-векторное умножение.
+    """
+
+    def __init__(self, max_items: int, ttl_sec: float, similarity_threshold: float):
+        self.max_items = max_items
+        self.ttl_sec = ttl_sec
+        self.similarity_threshold = similarity_threshold
+        # key -> (строка матрицы, время записи, значение); порядок вставки = порядок LRU
+        self._entries: Dict[bytes, Tuple[int, float, Any]] = {}
+        self._row_keys: List[Optional[bytes]] = [None] * max_items
+        self._free_rows = list(range(max_items - 1, -1, -1))
+        self._vectors: Optional[np.ndarray] = None
+
+    @staticmethod
+    def _key(question: str) -> bytes:
+        return question_key(question)
+
+    def _evict(self, key: bytes) -> None:
+        row, _, _ = self._entries.pop(key)
+        self._vectors[row] = 0.0
+        self._row_keys[row] = None
+        self._free_rows.append(row)
+
+    def _lookup(self, key: bytes) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.ttl_sec:
+            self._evict(key)
+            return None
+        # Переносим запись в конец — самая свежая по использованию
+        self._entries[key] = self._entries.pop(key)
+        return entry[2]
+
+    def get_exact(self, question: str) -> Optional[Any]:
+        return self._lookup(self._key(question))
+
+    def get_similar(self, embedding: List[float]) -> Optional[Any]:
+        if not self._entries or self._vectors is None:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm or query.shape[0] != self._vectors.shape[1]:
+            return None
+        sims = self._vectors @ (query / norm)
+        # Кандидаты выше порога по убыванию близости: если лучший уже истек, подойдет следующий
+        rows = np.flatnonzero(sims >= self.similarity_threshold)
+        for row in rows[np.argsort(sims[rows])[::-1]]:
+            key = self._row_keys[row]
+            if key is None:
+                continue
+            value = self._lookup(key)
+            if value is not None:
+                return value
+        return None
+
+    def put(self, question: str, embedding: List[float], value: Any) -> None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_items, vector.shape[0]), dtype=np.float32)
+        elif vector.shape[0] != self._vectors.shape[1]:
+            return
+
+        key = self._key(question)
+        if key in self._entries:
+            self._evict(key)
+        if not self._free_rows:
+            self._evict(next(iter(self._entries)))
+
+        row = self._free_rows.pop()
+        self._vectors[row] = vector / norm
+        self._row_keys[row] = key
+        self._entries[key] = (row, time.monotonic(), value)
+
+    def clear(self) -> None:
+        """Сбрасывает все ответы, например после переиндексации документов."""
+        self._entries.clear()
+        self._row_keys = [None] * self.max_items
+        self._free_rows = list(range(self.max_items - 1, -1, -1))
+        if self._vectors is not None:
+            self._vectors[:] = 0.0
+
+
+class TTLCache:
+    """LRU-кэш с ограниченным временем жизни записей; считает попадания и промахи."""
+
+    def __init__(self, max_items: int, ttl_sec: float):
+        self.max_items = max_items
+        self.ttl_sec = ttl_sec
+        self._data: "OrderedDict[bytes, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if time.monotonic() - entry[0] > self.ttl_sec:
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: bytes, value: Any) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_items:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
@@ -5,8 +5,27 @@ load_dotenv()
 
 QDRANT_HOST = os.getenv("QDRANT_HOST", "192.168.42.188")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "true").lower() == "true"
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "internal_regulations_v2")
 SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", 5))
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", 128))
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", 3.0))
+
+# Кэш ответов: размер, время жизни (сек) и порог косинусной близости для похожих вопросов.
+# Порог высокий: при 0.93 совпадали разные вопросы с одинаковой формулировкой
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1024))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.97))
+# Метка, которую rag-ingest обновляет после каждой загрузки изменений; при ее смене кэши сбрасываются.
+# Проверяется не чаще, чем раз в INGEST_STAMP_CHECK_INTERVAL секунд
+INGEST_STAMP_FILE = os.getenv("INGEST_STAMP_FILE", os.path.join(os.getenv("DOCS_DIR", "./data"), ".ingest_version"))
+INGEST_STAMP_CHECK_INTERVAL = float(os.getenv("INGEST_STAMP_CHECK_INTERVAL", 10))
+
+# Кэш результатов поиска в Qdrant: размер и время жизни (сек)
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1024))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 20))
 
 EMBEDDING_SERVICE_ENDPOINT = os.getenv("EMBEDDING_SERVICE_ENDPOINT", "http://192.168.45.63:8001/create_embedding")
-OPENAI_API_ENDPOINT = os.getenv("RAG_BOT_ENDPOINT", "http://rag-bot:8000/generate_answer")
\ No newline at end of file
+OPENAI_API_ENDPOINT = os.getenv("RAG_BOT_ENDPOINT", "http://rag-bot:8000/generate_answer")
+RAG_BOT_STREAM_ENDPOINT = os.getenv("RAG_BOT_STREAM_ENDPOINT", f"{OPENAI_API_ENDPOINT}_stream")
\ No newline at end of file
@@ -1,165 +1,350 @@
 import os
 import sys
-import requests
+import asyncio
+import hashlib
+import logging
+import time
+import functools
+import httpx
+import orjson
 import gradio as gr
 import config
+from batcher import MicroBatcher
+from cache import AnswerCache, TTLCache, embedding_key
+from collections import OrderedDict, defaultdict
 from pathlib import Path
-from qdrant_client import QdrantClient
-from typing import Optional, Tuple, List
-from openai import OpenAI
+from qdrant_client import AsyncQdrantClient, models
+from typing import AsyncIterator, Optional, Tuple, List
+from openai import AsyncOpenAI
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 # Для просмотра файлов
 try:
-    import docx
-    import pypdf
+    import docx2txt
+    import pypdfium2 as pdfium
 except ImportError:
-    print("Warning: python-docx or pypdf not installed. Viewer will be limited.")
+    logger.warning("docx2txt or pypdfium2 not installed. Viewer will be limited.")
 
 DOCS_DIR = os.getenv("DOCS_DIR", "./data")
 EMBEDDING_MODEL = os.getenv("OPENROUTER_EMBEDDING_MODEL", "google/gemini-embedding-001")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 1024))
+# Окно, в течение которого одновременные запросы эмбеддингов собираются в один батч (сек)
+EMBEDDING_BATCH_WINDOW = float(os.getenv("EMBEDDING_BATCH_WINDOW", 0.015))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", 64))
+# Не больше стольких одновременных запросов к API эмбеддингов; при 429 SDK сам повторяет запрос
+# с экспоненциальной задержкой и учетом Retry-After
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 8))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 5))
+CHUNK_SEPARATOR = "\n\n--- ЕЩЕ ОДИН ФРАГМЕНТ ---\n\n"
+
+def _embedding_cache_key(text: str) -> str:
+    # Ключ фиксированной длины, чтобы длинные вопросы не раздували кэш
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
 
 class RAGOrchestrator:
-    def __init__(self, qdrant_client: QdrantClient):
+    def __init__(self, qdrant_client: AsyncQdrantClient):
         self.qdrant_client = qdrant_client
+        # Один клиент на весь процесс: keep-alive соединения к rag-bot переиспользуются между запросами.
+        # HTTP/2 включается, только если rag-bot стоит за TLS-прокси (ALPN); иначе остается HTTP/1.1 keep-alive
+        self._http = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(120.0, connect=5.0),
+            # Простаивающее соединение закрываем раньше, чем rag-bot (uvicorn timeout_keep_alive=90)
+            limits=httpx.Limits(max_keepalive_connections=64, keepalive_expiry=60)
+        )
+        # LRU-кэш эмбеддингов: повторные вопросы не ходят в OpenRouter
+        self._embedding_cache: "OrderedDict[str, list[float]]" = OrderedDict()
+        # Одновременные запросы разных пользователей идут в OpenRouter одним батчем; батчи отправляются
+        # параллельно, но не больше EMBEDDING_CONCURRENCY сразу. Один плохой вопрос (например, слишком
+        # длинный) не лишает ответа остальных: упавший батч повторяется по одному
+        self._embedding_batcher = MicroBatcher(
+            self._embed_batch,
+            window=EMBEDDING_BATCH_WINDOW,
+            max_batch=EMBEDDING_MAX_BATCH,
+            max_in_flight=EMBEDDING_CONCURRENCY,
+            split_on_error=True
+        )
+        self._collection_ready = False
+        # Кэш готовых ответов: точный по тексту вопроса и семантический по эмбеддингу
+        self._answer_cache = AnswerCache(
+            max_items=config.ANSWER_CACHE_SIZE,
+            ttl_sec=config.ANSWER_CACHE_TTL,
+            similarity_threshold=config.ANSWER_CACHE_SIMILARITY
+        )
+        # Результаты поиска живут несколько секунд — гасят повторы при всплесках одинаковых запросов
+        self._search_cache = TTLCache(max_items=config.SEARCH_CACHE_SIZE, ttl_sec=config.SEARCH_CACHE_TTL)
+        self._ingest_stamp: Optional[int] = self._read_ingest_stamp()
+        self._ingest_stamp_checked = 0.0
         
         if not OPENROUTER_API_KEY:
-            print("❌ ОШИБКА: OPENROUTER_API_KEY не установлен.")
+            logger.error("OPENROUTER_API_KEY не установлен.")
             self.openai_client = None
         else:
-            print(f"Настройка OpenRouter клиента для эмбеддингов (модель: {EMBEDDING_MODEL})...")
-            self.openai_client = OpenAI(
+            logger.info("Настройка OpenRouter клиента для эмбеддингов (модель: %s)...", EMBEDDING_MODEL)
+            self.openai_client = AsyncOpenAI(
                 api_key=OPENROUTER_API_KEY,
-                base_url="https://openrouter.ai/api/v1"
+                base_url="https://openrouter.ai/api/v1",
+                max_retries=EMBEDDING_MAX_RETRIES
             )
-        print("✅ Клиент-оркестратор готов к работе.")
+        logger.info("Клиент-оркестратор готов к работе.")
 
-    def get_embedding(self, text: str) -> Optional[list[float]]:
-        """Получает эмбеддинг через OpenRouter."""
-        if not self.openai_client:
-            print("Клиент OpenAI не инициализирован.")
-            return None
-            
+    async def _ensure_collection(self) -> bool:
+        """Однократно проверяет коллекцию в Qdrant; заодно устанавливает соединение до первого поиска."""
+        if not self._collection_ready:
+            try:
+                await self.qdrant_client.get_collection(config.COLLECTION_NAME)
+                self._collection_ready = True
+            except Exception as e:
+                logger.error("Коллекция %s в Qdrant недоступна: %s", config.COLLECTION_NAME, e)
+        return self._collection_ready
+
+    @staticmethod
+    def _read_ingest_stamp() -> Optional[int]:
         try:
-            resp = self.openai_client.embeddings.create(
-                model=EMBEDDING_MODEL,
-                input=text
-            )
-            return resp.data[0].embedding
-        except Exception as e:
-            print(f"Ошибка получения эмбеддинга: {e}")
+            return os.stat(config.INGEST_STAMP_FILE).st_mtime_ns
+        except OSError:
             return None
 
-    def query_llm(self, question: str, context: str) -> str:
-        """Обращается к LLM-сервису (rag-bot)."""
-        result = self._make_api_request(
-            config.OPENAI_API_ENDPOINT,
-            {"question": question, "context": context},
-            "answer",
-            "LLM-сервису",
-            120
-        )
-        return result or "Сервер вернул пустой ответ."
-    
-    def _make_api_request(self, endpoint: str, payload: dict, response_key: str, service_name: str, timeout: int):
+    def _invalidate_on_reingest(self) -> None:
+        """Сбрасывает кэши ответов и поиска, если rag-ingest загрузил изменения с момента прошлой проверки."""
+        now = time.monotonic()
+        if now - self._ingest_stamp_checked < config.INGEST_STAMP_CHECK_INTERVAL:
+            return
+        self._ingest_stamp_checked = now
+        stamp = self._read_ingest_stamp()
+        if stamp != self._ingest_stamp:
+            self._ingest_stamp = stamp
+            self._answer_cache.clear()
+            self._search_cache.clear()
+            logger.info("Документы переиндексированы — кэши ответов и поиска сброшены.")
+
+    async def get_embedding(self, text: str) -> Optional[list[float]]:
+        """Получает эмбеддинг через OpenRouter; одновременные запросы разных пользователей идут одним батчем."""
+        key = _embedding_cache_key(text)
+        if key in self._embedding_cache:
+            self._embedding_cache.move_to_end(key)
+            return self._embedding_cache[key]
+
         try:
-            response = requests.post(endpoint, json=payload, timeout=timeout)
+            return await self._embedding_batcher.submit(text)
+        except Exception:
+            # Причина уже записана в лог get_embeddings_batch и MicroBatcher
+            return None
+
+    async def _embed_batch(self, texts: List[str]) -> List[list[float]]:
+        embeddings = await self.get_embeddings_batch(texts)
+        if embeddings is None:
+            raise RuntimeError("не удалось получить эмбеддинги")
+        return embeddings
+
+    async def get_embeddings_batch(self, texts: List[str]) -> Optional[List[list[float]]]:
+        """Получает эмбеддинги для списка текстов одним запросом, пропуская закэшированные."""
+        if not self.openai_client:
+            logger.error("Клиент OpenAI не инициализирован.")
+            return None
+
+        keys = [_embedding_cache_key(text) for text in texts]
+        found = {key: self._embedding_cache[key] for key in keys if key in self._embedding_cache}
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+
+        if missing:
+            try:
+                resp = await self.openai_client.embeddings.create(
+                    model=EMBEDDING_MODEL,
+                    input=list(missing.values())
+                )
+            except Exception as e:
+                logger.error("Ошибка получения эмбеддинга: %s", e)
+                return None
+            found.update(zip(missing, (item.embedding for item in sorted(resp.data, key=lambda d: d.index))))
+
+        for key in found:
+            self._embedding_cache[key] = found[key]
+            self._embedding_cache.move_to_end(key)
+        while len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+            self._embedding_cache.popitem(last=False)
+
+        return [found[key] for key in keys]
+
+    async def query_llm(self, question: str, context: list[dict]) -> AsyncIterator[str]:
+        """Обращается к LLM-сервису (rag-bot) и отдает ответ по мере генерации; ошибки httpx пробрасываются."""
+        # orjson пишет кириллицу как UTF-8 (2 байта на символ), а не \uXXXX-экранами, как json.dumps в httpx
+        async with self._http.stream(
+            "POST",
+            config.RAG_BOT_STREAM_ENDPOINT,
+            content=orjson.dumps({"question": question, "context": context}),
+            headers={"Content-Type": "application/json"}
+        ) as response:
             response.raise_for_status()
-            return response.json().get(response_key)
-        except requests.exceptions.RequestException as e:
-            error_msg = f"Ошибка при обращении к {service_name}: {e}"
-            print(error_msg)
-            return None if response_key == "embedding" else error_msg
+            async for delta in response.aiter_text():
+                yield delta
 
-    def process_query(self, question: str) -> Tuple[str, List[str], dict]:
+    async def process_query(self, question: str) -> AsyncIterator[Tuple[str, List[str], dict]]:
+        """Полный цикл обработки вопроса; отдает (ответ на текущий момент, источники, фрагменты)."""
         if not question:
-            return "Пожалуйста, введите вопрос.", [], {}
+            yield "Пожалуйста, введите вопрос.", [], {}
+            return
+
+        self._invalidate_on_reingest()
+        cached = self._answer_cache.get_exact(question)
+        if cached:
+            self._log_completion("ответ взят из кэша")
+            yield cached
+            return
 
-        self._log_step(1, f"Получение эмбеддинга для вопроса: '{question[:30]}...'")
-        question_embedding = self.get_embedding(question)
+        self._log_step(1, "Получение эмбеддинга для вопроса: '%.30s...'", question)
+        # Эмбеддинг и проверка Qdrant не зависят друг от друга — выполняем параллельно
+        question_embedding, collection_ready = await asyncio.gather(
+            self.get_embedding(question),
+            self._ensure_collection()
+        )
+        if not collection_ready:
+            yield "База знаний недоступна.", [], {}
+            return
         if not question_embedding:
-            return "Не удалось получить вектор для вопроса.", [], {}
+            yield "Не удалось получить вектор для вопроса.", [], {}
+            return
         self._log_completion("эмбеддинг получен")
 
+        cached = self._answer_cache.get_similar(question_embedding)
+        if cached:
+            self._log_completion("ответ на похожий вопрос взят из кэша")
+            yield cached
+            return
+
         self._log_step(2, "Поиск релевантного контекста в Qdrant...")
-        structured_context, sources, chunks_map = self._search_and_prepare_context(question_embedding)
+        structured_context, sources, chunks_map = await self._search_and_prepare_context(question_embedding)
         if not structured_context:
-            return "В базе знаний не найдено релевантного контекста.", [], {}
+            yield "В базе знаний не найдено релевантного контекста.", [], {}
+            return
 
         self._log_step(3, "Отправка запроса на LLM-сервис...")
-        answer = self.query_llm(question, structured_context)
+        answer = ""
+        yield answer, sources, chunks_map
+        try:
+            async for delta in self.query_llm(question, structured_context):
+                answer += delta
+                yield answer, sources, chunks_map
+        except httpx.HTTPError as e:
+            logger.error("Ошибка при обращении к LLM-сервису: %s", e)
+            error_msg = f"Ошибка при обращении к LLM-сервису: {e}"
+            yield (f"{answer}\n\n{error_msg}" if answer else error_msg), sources, chunks_map
+            return
+        if not answer:
+            yield "Сервер вернул пустой ответ.", sources, chunks_map
+            return
         self._log_completion("ответ от LLM получен")
-
-        return answer, sources, chunks_map
+        # В кэш попадают только полностью полученные ответы
+        self._answer_cache.put(question, question_embedding, (answer, sources, chunks_map))
     
-    def _search_and_prepare_context(self, question_embedding: list[float]) -> Tuple[list[dict], list[str], dict]:
-        search_results = self.qdrant_client.search(
+    async def _search_and_prepare_context(self, question_embedding: list[float]) -> Tuple[list[dict], list[str], dict]:
+        cache_key = embedding_key(question_embedding)
+        cached = self._search_cache.get(cache_key)
+        if cached:
+            self._log_completion("результаты поиска взяты из кэша")
+            return cached
+        
+        response = await self.qdrant_client.query_points(
             collection_name=config.COLLECTION_NAME,
-            query_vector=question_embedding,
+            query=question_embedding,
             limit=config.SEARCH_LIMIT,
-            with_payload=True
+            with_payload=["text", "source_file"],
+            search_params=models.SearchParams(
+                hnsw_ef=config.QDRANT_HNSW_EF,
+                # Кандидаты отбираются по квантованным векторам и пересчитываются по исходным
+                quantization=models.QuantizationSearchParams(rescore=True, oversampling=config.QDRANT_OVERSAMPLING)
+            )
         )
-        
-        if not search_results:
-            return [], [], {}
-        
+        # Один проход по точкам: из payload берем только текст и имя файла.
+        # Фрагменты по файлам копятся списком и склеиваются только при показе документа
         context_payload = []
-        chunks_map = {}
-        
-        for result in search_results:
-            text = result.payload['text']
-            fname = result.payload.get('source_file', 'unknown')
-            
+        chunks_map = defaultdict(list)
+        for hit in response.points:
+            payload = hit.payload
+            text, fname = payload['text'], payload.get('source_file', 'unknown')
             context_payload.append({"text": text, "file": fname})
-            
-            if fname in chunks_map:
-                chunks_map[fname] += "\n\n--- ЕЩЕ ОДИН ФРАГМЕНТ ---\n\n" + text
-            else:
-                chunks_map[fname] = text
+            chunks_map[fname].append(text)
+        
+        if not context_payload:
+            return [], [], {}
+        chunks_map = dict(chunks_map)
         
-        sources = sorted(list(chunks_map.keys()))[:5]
-        self._log_completion(f"найдено {len(sources)} источников")
+        sources = sorted(chunks_map)[:5]
+        self._log_completion("найдено %d источников", len(sources))
+        self._search_cache.set(cache_key, (context_payload, sources, chunks_map))
         return context_payload, sources, chunks_map
     
-    def _log_step(self, step_num: int, message: str) -> None:
-        print(f"\n{step_num}. {message}")
+    # Пошаговые сообщения идут на уровне DEBUG и форматируются, только если уровень включен (LOG_LEVEL=DEBUG)
+    def _log_step(self, step_num: int, message: str, *args) -> None:
+        logger.debug("%d. " + message, step_num, *args)
     
-    def _log_completion(self, message: str) -> None:
-        print(f"   ...{message}.")
+    def _log_completion(self, message: str, *args) -> None:
+        logger.debug("   ..." + message + ".", *args)
+
+# Индекс "имя файла -> путь" по DOCS_DIR, чтобы не обходить дерево документов на каждый клик
+_file_index: dict[str, Path] = {}
+
+def build_file_index() -> None:
+    _file_index.clear()
+    for path in Path(DOCS_DIR).rglob("*"):
+        if path.is_file():
+            _file_index.setdefault(path.name, path)
+    logger.info("Проиндексировано файлов в %s: %d", DOCS_DIR, len(_file_index))
 
 def get_file_content(file_name: str) -> str:
     root_path = Path(DOCS_DIR)
     path = root_path / file_name
     
-    # If not found directly, try to find it recursively
+    # If not found directly, look it up in the index
     if not path.exists():
-        found_files = list(root_path.rglob(file_name))
-        if found_files:
-            path = found_files[0]
+        indexed = _file_index.get(file_name)
+        if indexed and indexed.exists():
+            path = indexed
         else:
-            return f"Файл '{file_name}' не найден в {DOCS_DIR} (и подпапках)."
+            # Fall back to a recursive search for files added after startup
+            found_files = list(root_path.rglob(file_name))
+            if not found_files:
+                return f"Файл '{file_name}' не найден в {DOCS_DIR} (и подпапках)."
+            path = _file_index[file_name] = found_files[0]
     
     try:
-        if path.suffix.lower() == ".docx":
-            doc = docx.Document(path)
-            return "\n".join([p.text for p in doc.paragraphs])
-        elif path.suffix.lower() == ".pdf":
-            reader = pypdf.PdfReader(path)
-            return "\n".join([page.extract_text() for page in reader.pages])
-        else:
-            with open(path, "r", encoding="utf-8") as f:
-                return f.read()
+        return _read_document(str(path), path.stat().st_mtime)
     except Exception as e:
         return f"Ошибка чтения файла: {e}"
 
+@functools.lru_cache(maxsize=64)
+def _read_document(path: str, mtime: float) -> str:
+    """Извлекает текст документа; mtime входит в ключ кэша, чтобы измененный файл перечитывался."""
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".docx":
+        return docx2txt.process(path)
+    elif suffix == ".pdf":
+        pdf = pdfium.PdfDocument(path)
+        try:
+            return "\n".join(page.get_textpage().get_text_range() for page in pdf)
+        finally:
+            pdf.close()
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
 # --- Инициализация и запуск Gradio ---
 if __name__ == "__main__":
     try:
-        print("Подключение к Qdrant...")
-        q_client = QdrantClient(host=config.QDRANT_HOST, port=config.QDRANT_PORT)
+        logger.info("Подключение к Qdrant...")
+        q_client = AsyncQdrantClient(
+            host=config.QDRANT_HOST,
+            port=config.QDRANT_PORT,
+            grpc_port=config.QDRANT_GRPC_PORT,
+            prefer_grpc=config.QDRANT_PREFER_GRPC
+        )
         orchestrator = RAGOrchestrator(qdrant_client=q_client)
+        build_file_index()
 
-        print("\nЗапуск интерфейса Gradio...")
+        logger.info("Запуск интерфейса Gradio...")
         
         with gr.Blocks(title="RAG Атомстройкомплекс") as demo:
             gr.Markdown("# 🧠 RAG-система для ВНД")
@@ -182,22 +367,33 @@ if __name__ == "__main__":
                 with gr.Column(scale=2):
                     doc_viewer = gr.TextArea(label="Содержимое документа (релевантный фрагмент)", lines=15, interactive=False)
 
-            def respond(question):
-                ans, srcs, chunks = orchestrator.process_query(question)
-                # Select first source if available
-                first_src = srcs[0] if srcs else None
-                # Get content for first source immediately
-                first_content = ""
-                if first_src and first_src in chunks:
-                    first_content = chunks[first_src]
-                
-                return ans, gr.update(choices=srcs, value=first_src), chunks, first_content
+            async def respond(question):
+                sources_shown = False
+                async for ans, srcs, chunks in orchestrator.process_query(question):
+                    if sources_shown:
+                        # Источники уже показаны — в браузер уходит только текст ответа
+                        yield {answer_output: ans}
+                        continue
+                    sources_shown = True
+                    # Select first source if available
+                    first_src = srcs[0] if srcs else None
+                    # Get content for first source immediately
+                    first_content = ""
+                    if first_src and first_src in chunks:
+                        first_content = CHUNK_SEPARATOR.join(chunks[first_src])
+                    
+                    yield {
+                        answer_output: ans,
+                        sources_dropdown: gr.update(choices=srcs, value=first_src),
+                        chunks_state: chunks,
+                        doc_viewer: first_content
+                    }
 
             def show_source(file_name, chunks):
                 if not file_name:
                     return ""
                 if chunks and file_name in chunks:
-                    return chunks[file_name]
+                    return CHUNK_SEPARATOR.join(chunks[file_name])
                 # Fallback to full content if somehow not in chunks (shouldn't happen for search results)
                 return get_file_content(file_name)
 
@@ -216,4 +412,4 @@ if __name__ == "__main__":
         demo.launch(server_name="0.0.0.0", server_port=7860)
 
     except Exception as e:
-        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА: {e}")
\ No newline at end of file
+        logger.critical("КРИТИЧЕСКАЯ ОШИБКА: %s", e, exc_info=True)
\ No newline at end of file
@@ -74,6 +74,17 @@ def clear_db():
     else:
         logger.info(f"Database file '{db_full_path}' not found.")
 
+    # The state DB runs in WAL mode; leftover -wal/-shm files from a killed run would be
+    # replayed into the next, freshly created DB
+    for suffix in ("-wal", "-shm"):
+        sidecar = Path(f"{db_full_path}{suffix}")
+        if sidecar.exists():
+            try:
+                os.remove(sidecar)
+                logger.info(f"Database file '{sidecar}' removed successfully.")
+            except Exception as e:
+                logger.error(f"Error removing database file '{sidecar}': {e}")
+
 if __name__ == "__main__":
     print(f"Target Collection: {COLLECTION_NAME}")
     print(f"Target DB: {DB_PATH}")
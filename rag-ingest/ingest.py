@@ -6,9 +6,14 @@ import sqlite3
 import requests
 import logging
 import shutil
+from array import array
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import chain, islice
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Tuple
 
+import httpx
 from openai import OpenAI
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
@@ -24,33 +29,63 @@ logger = logging.getLogger(__name__)
 # --- Configuration ---
 DOCS_DIR = os.getenv("DOCS_DIR", "./data") 
 DB_PATH = os.getenv("INGEST_DB_PATH", "/app/state/ingest_state.db")
+# Метка в общем с rag-chat каталоге документов: обновляется после загрузки изменений, rag-chat по ней сбрасывает кэши
+INGEST_STAMP_FILE = os.getenv("INGEST_STAMP_FILE", os.path.join(DOCS_DIR, ".ingest_version"))
 
 QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "internal_regulations_v2")
+# binary: 1 бит на измерение, векторы целиком помещаются в RAM; scalar: int8, в 4 раза меньше float32
+# с меньшей потерей точности; none — без квантования
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "binary").lower()
 
 # Embeddings Config
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 EMBEDDING_MODEL = os.getenv("OPENROUTER_EMBEDDING_MODEL", "google/gemini-embedding-001")
 
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 100
+# Размер чанка в символах; подбирается под окно модели эмбеддингов (меньше чанков — меньше запросов и точек)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 100))
+# Чанков в одном запросе к embeddings API
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+# Параллельных запросов к embeddings API; повторы с экспоненциальной паузой делает клиент openai
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 5))
+# Эмбеддингов повторяющихся чанков (шаблоны, колонтитулы), хранимых между файлами одного запуска
+INGEST_EMBEDDING_CACHE_SIZE = int(os.getenv("INGEST_EMBEDDING_CACHE_SIZE", 1024))
+# Процессов для разбора PDF/DOCX (CPU-bound)
+PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", min(os.cpu_count() or 1, 4)))
+# Точек в одном запросе к Qdrant и число процессов загрузки (parallel > 1 запускает процессы на каждый вызов)
+QDRANT_UPLOAD_BATCH_SIZE = int(os.getenv("QDRANT_UPLOAD_BATCH_SIZE", 256))
+QDRANT_UPLOAD_PARALLEL = int(os.getenv("QDRANT_UPLOAD_PARALLEL", 1))
+# Порог (KB) построения HNSW; новая коллекция создаётся с 0, порог возвращается после загрузки
+QDRANT_INDEXING_THRESHOLD = int(os.getenv("QDRANT_INDEXING_THRESHOLD", 20000))
 
 # --- Database ---
 def init_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
+    # WAL + NORMAL: commits no longer fsync; an OS crash may lose the last commits, which only re-ingests those files
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
     c.execute('''CREATE TABLE IF NOT EXISTS files 
-                 (path TEXT PRIMARY KEY, hash TEXT, last_updated TIMESTAMP)''')
+                 (path TEXT PRIMARY KEY, hash TEXT, last_updated TIMESTAMP,
+                  size INTEGER, mtime_ns INTEGER)''')
+    # Migrate state databases created before size/mtime_ns were tracked
+    columns = {row[1] for row in c.execute("PRAGMA table_info(files)")}
+    for column in ("size", "mtime_ns"):
+        if column not in columns:
+            c.execute(f"ALTER TABLE files ADD COLUMN {column} INTEGER")
     conn.commit()
     return conn
 
 def get_file_hash(path: str) -> str:
+    # MD5 is kept so hashes stored by earlier runs stay comparable; it is a change detector, not a security check
     hasher = hashlib.md5()
     with open(path, 'rb') as f:
-        buf = f.read()
-        hasher.update(buf)
+        while buf := f.read(1 << 20):
+            hasher.update(buf)
     return hasher.hexdigest()
 
 # --- OpenAI Client for Embeddings (via OpenRouter) ---
@@ -60,8 +95,16 @@ if not OPENROUTER_API_KEY:
 
 openai_client = OpenAI(
     api_key=OPENROUTER_API_KEY,
-    base_url="https://openrouter.ai/api/v1"
+    base_url="https://openrouter.ai/api/v1",
+    max_retries=EMBEDDING_MAX_RETRIES,
+    # One keep-alive HTTP/2 connection multiplexes the concurrent embedding batches
+    http_client=httpx.Client(
+        http2=True,
+        timeout=httpx.Timeout(120.0, connect=5.0),
+        limits=httpx.Limits(max_connections=EMBEDDING_CONCURRENCY, keepalive_expiry=300)
+    )
 )
+_embedding_pool = ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY, thread_name_prefix="embed")
 
 # --- Embeddings ---
 def get_embedding(text: str) -> Optional[List[float]]:
@@ -76,14 +119,95 @@ def get_embedding(text: str) -> Optional[List[float]]:
         logger.error(f"Embedding error via OpenRouter (Model: {EMBEDDING_MODEL}): {e}")
         return None
 
+def _embed_batch(batch: List[str]) -> List[Optional[List[float]]]:
+    try:
+        resp = openai_client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=batch
+        )
+        # The API does not guarantee response order, restore it by index
+        return [item.embedding for item in sorted(resp.data, key=lambda d: d.index)]
+    except Exception as e:
+        logger.error(f"Embedding batch error via OpenRouter (Model: {EMBEDDING_MODEL}): {e}")
+        return [None] * len(batch)
+
+# chunk hash -> float32 vector; float32 arrays take ~8x less memory than lists of floats
+_embedding_cache: "OrderedDict[bytes, array]" = OrderedDict()
+
+def _chunk_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+def iter_embeddings(texts: List[str]) -> Iterator[Optional[List[float]]]:
+    """Embeds texts in batches of EMBEDDING_BATCH_SIZE, up to EMBEDDING_CONCURRENCY batches in flight.
+
+    Identical texts are embedded once, and texts seen in earlier files are served from
+    an LRU cache. Yields one embedding per text in order as soon as its batch is done,
+    so the caller can upload earlier batches while later ones are still being embedded.
+    A failed batch yields None for each of its texts.
+    """
+    keys = [_chunk_key(text) for text in texts]
+    resolved: Dict[bytes, Optional[List[float]]] = {}
+    missing = []
+    for key, text in zip(keys, texts):
+        if key in resolved:
+            continue
+        cached = _embedding_cache.get(key)
+        if cached is not None:
+            _embedding_cache.move_to_end(key)
+            resolved[key] = cached.tolist()
+        else:
+            # Placeholder marks the key as queued; the real vector arrives from the pool
+            resolved[key] = None
+            missing.append((key, text))
+
+    batches = [missing[start:start + EMBEDDING_BATCH_SIZE] for start in range(0, len(missing), EMBEDDING_BATCH_SIZE)]
+    results = _embedding_pool.map(_embed_batch, [[text for _, text in batch] for batch in batches])
+    fresh = zip((key for key, _ in missing), chain.from_iterable(results))
+    pending = {key for key, _ in missing}
+
+    for key in keys:
+        # Missing texts are queued in first-occurrence order, so this never runs ahead of the pool
+        while key in pending:
+            fresh_key, embedding = next(fresh)
+            pending.discard(fresh_key)
+            resolved[fresh_key] = embedding
+            if embedding:
+                _embedding_cache[fresh_key] = array("f", embedding)
+                if len(_embedding_cache) > INGEST_EMBEDDING_CACHE_SIZE:
+                    _embedding_cache.popitem(last=False)
+        yield resolved[key]
+
 # --- Qdrant ---
 def get_qdrant_client():
     return QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
 
-def ensure_collection(client):
-    try:
-        client.get_collection(COLLECTION_NAME)
-    except Exception:
+def get_quantization_config():
+    if QDRANT_QUANTIZATION == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    if QDRANT_QUANTIZATION == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, always_ram=True)
+        )
+    return None
+
+def create_source_file_index(client):
+    """Keyword index for source_file filters (delete_file_chunks, per-document lookups)."""
+    client.create_payload_index(
+        collection_name=COLLECTION_NAME,
+        field_name="source_file",
+        field_schema=models.PayloadSchemaType.KEYWORD
+    )
+    logger.info(f"Created payload index on source_file in {COLLECTION_NAME}")
+
+# Collections already checked or created by this process
+_ready_collections = set()
+
+def ensure_collection(client) -> bool:
+    """Creates the collection if needed; returns True if its indexing threshold must be restored after the load."""
+    if COLLECTION_NAME in _ready_collections:
+        return False
+    restore_indexing = False
+    if not client.collection_exists(COLLECTION_NAME):
         logger.info(f"Collection {COLLECTION_NAME} not found. Creating...")
         
         # Test embedding to get dim
@@ -92,39 +216,82 @@ def ensure_collection(client):
             dim = len(test_emb)
             client.create_collection(
                 collection_name=COLLECTION_NAME,
-                vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE)
+                vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE),
+                quantization_config=get_quantization_config(),
+                # No HNSW maintenance during the initial bulk load, see enable_indexing()
+                optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0)
             )
-            logger.info(f"Created collection with dimension {dim}")
+            create_source_file_index(client)
+            logger.info(f"Created collection with dimension {dim} (quantization: {QDRANT_QUANTIZATION})")
+            restore_indexing = True
         else:
             logger.error("Could not determine embedding dimension. Collection creation failed.")
             sys.exit(1)
+    else:
+        info = client.get_collection(COLLECTION_NAME)
+        if "source_file" not in info.payload_schema:
+            # Collections created before the index was introduced
+            create_source_file_index(client)
+        # A threshold of 0 is left behind by a run that created the collection and was killed before
+        # restoring it; any other value may have been set by an operator and is kept as is
+        restore_indexing = info.config.optimizer_config.indexing_threshold == 0
+    _ready_collections.add(COLLECTION_NAME)
+    return restore_indexing
+
+def enable_indexing(client):
+    """Restores the indexing threshold so HNSW is built once over all uploaded points."""
+    client.update_collection(
+        collection_name=COLLECTION_NAME,
+        optimizer_config=models.OptimizersConfigDiff(indexing_threshold=QDRANT_INDEXING_THRESHOLD)
+    )
 
 def upload_chunks(client, chunks: List[str], source_file: str):
-    points = []
     import uuid
-    
-    for i, text in enumerate(chunks):
-        embedding = get_embedding(text)
-        if not embedding:
-            logger.warning(f"Skipping chunk {i} in {source_file} due to embedding failure.")
-            continue
-            
-        points.append(models.PointStruct(
-            id=str(uuid.uuid4()),
-            vector=embedding,
-            payload={
-                "text": text,
-                "source_file": source_file,
-                "chunk_index": i
-            }
-        ))
-    
-    if points:
-        client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=points
-        )
-        logger.info(f"Uploaded {len(points)} chunks for {source_file}")
+    uploaded = 0
+
+    def iter_points():
+        nonlocal uploaded
+        for i, (text, embedding) in enumerate(zip(chunks, iter_embeddings(chunks))):
+            if not embedding:
+                logger.warning(f"Skipping chunk {i} in {source_file} due to embedding failure.")
+                continue
+
+            uploaded += 1
+            yield models.PointStruct(
+                id=str(uuid.uuid4()),
+                vector=embedding,
+                payload={
+                    "text": text,
+                    "source_file": source_file,
+                    "chunk_index": i
+                }
+            )
+
+    # Points are consumed lazily: each full batch is sent while the next embeddings are in flight.
+    # wait=False: do not block on indexing of every batch; Qdrant applies updates in order
+    client.upload_points(
+        collection_name=COLLECTION_NAME,
+        points=iter_points(),
+        batch_size=QDRANT_UPLOAD_BATCH_SIZE,
+        parallel=QDRANT_UPLOAD_PARALLEL,
+        wait=False
+    )
+    if uploaded:
+        logger.info(f"Uploaded {uploaded} chunks for {source_file}")
+
+def wait_for_updates(client):
+    """Blocks until Qdrant has applied all updates sent so far (uploads above use wait=False).
+
+    Updates to a collection are applied in order, so a waited no-op delete is a barrier:
+    it matches no points (no file has an empty name) and returns only after earlier updates are searchable.
+    """
+    client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=models.Filter(
+            must=[models.FieldCondition(key="source_file", match=models.MatchValue(value=""))]
+        ),
+        wait=True
+    )
 
 def delete_file_chunks(client, source_file: str):
     client.delete(
@@ -148,40 +315,85 @@ def parse_docx(path: Path) -> str:
 
 def parse_pdf(path: Path) -> str:
     import pypdf
-    text = ""
+    parts = []
     try:
         reader = pypdf.PdfReader(path)
         for page in reader.pages:
-            text += page.extract_text() + "\n"
+            parts.append(page.extract_text() or "")
+            parts.append("\n")
     except Exception as e:
         logger.error(f"Error parsing PDF {path}: {e}")
-    return text
+    return "".join(parts)
+
+def parse_document(path: Path) -> str:
+    """Extracts text from a DOCX or PDF file; runs in a worker process."""
+    if path.suffix.lower() == ".docx":
+        return parse_docx(path)
+    if path.suffix.lower() == ".pdf":
+        return parse_pdf(path)
+    return ""
+
+def iter_parsed(pool: ProcessPoolExecutor, paths) -> Iterator[Tuple[Path, Future]]:
+    """Yields parse futures as they complete, with at most 2 * PARSE_WORKERS files in flight.
+
+    The next file is submitted before a result is handed out, so workers keep parsing while
+    the caller embeds and uploads, and parsed texts never pile up faster than they are consumed.
+    """
+    queue = iter(paths)
+    futures = {pool.submit(parse_document, path): path for path in islice(queue, 2 * PARSE_WORKERS)}
+    while futures:
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            path = futures.pop(future)
+            next_path = next(queue, None)
+            if next_path is not None:
+                futures[pool.submit(parse_document, next_path)] = next_path
+            yield path, future
 
 def chunk_text(text: str, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP) -> List[str]:
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + size
-        chunks.append(text[start:end])
-        start += (size - overlap)
-    return chunks
+    return [text[start:start + size] for start in range(0, len(text), size - overlap)]
 
 # --- Main Loop ---
-def process_docs(docs_dir: Path):
-    conn = init_db()
+def scan_files(directory) -> Iterator[os.DirEntry]:
+    """Recursively yields file entries; DirEntry.stat() reuses data from the directory read where the OS provides it.
+
+    Like os.walk, symlinked directories are not descended into and unreadable directories are skipped.
+    """
+    try:
+        entries = os.scandir(directory)
+    except OSError as e:
+        logger.warning(f"Skipping unreadable directory {directory}: {e}")
+        return
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from scan_files(entry.path)
+                elif entry.is_file():
+                    yield entry
+            except OSError as e:
+                # e.g. a symlink loop or a dangling link that cannot be resolved
+                logger.warning(f"Skipping {entry.path}: {e}")
+
+def touch_ingest_stamp():
+    """Signals rag-chat that the indexed documents changed, so its answer cache is stale."""
+    try:
+        Path(INGEST_STAMP_FILE).touch()
+    except OSError as e:
+        logger.warning(f"Could not update ingest stamp {INGEST_STAMP_FILE}: {e}")
+
+def ingest_files(conn, client, docs_dir: Path):
     c = conn.cursor()
-    client = get_qdrant_client()
-    ensure_collection(client)
-    
+
     # 1. Scan Files & Apply Priority
     files_map = {} 
-    for root, dirs, files in os.walk(docs_dir):
-        for f in files:
-            path = Path(root) / f
-            if f.lower().endswith(".docx"):
-                files_map.setdefault(path.stem, {})["docx"] = path
-            elif f.lower().endswith(".pdf"):
-                files_map.setdefault(path.stem, {})["pdf"] = path
+    for entry in scan_files(docs_dir):
+        path = Path(entry.path)
+        name = entry.name.lower()
+        if name.endswith(".docx"):
+            files_map.setdefault(path.stem, {})["docx"] = (path, entry)
+        elif name.endswith(".pdf"):
+            files_map.setdefault(path.stem, {})["pdf"] = (path, entry)
     
     # 2. Determine final list
     final_files = []
@@ -193,45 +405,78 @@ def process_docs(docs_dir: Path):
         elif "pdf" in variants:
             final_files.append(variants["pdf"])
 
-    # 3. Process
-    for file_path in final_files:
+    # 3. Select changed files: size and mtime first, content hash only when they differ
+    pending = {}
+    for file_path, entry in final_files:
         str_path = str(file_path)
-        current_hash = get_file_hash(str_path)
+        stat = entry.stat()
         
-        c.execute("SELECT hash FROM files WHERE path=?", (str_path,))
+        c.execute("SELECT hash, size, mtime_ns FROM files WHERE path=?", (str_path,))
         row = c.fetchone()
         
-        if row and row[0] == current_hash:
+        if row and (row[1], row[2]) == (stat.st_size, stat.st_mtime_ns):
             logger.info(f"Skipping {file_path.name} (unchanged)")
             continue
-            
-        logger.info(f"Processing {file_path.name}...")
-        
-        text = ""
-        if file_path.suffix.lower() == ".docx":
-            text = parse_docx(file_path)
-        elif file_path.suffix.lower() == ".pdf":
-            text = parse_pdf(file_path)
-            
-        if not text.strip():
-            logger.warning(f"No text extracted from {file_path}")
+
+        current_hash = get_file_hash(str_path)
+        if row and row[0] == current_hash:
+            logger.info(f"Skipping {file_path.name} (unchanged)")
+            c.execute("UPDATE files SET size=?, mtime_ns=? WHERE path=?",
+                      (stat.st_size, stat.st_mtime_ns, str_path))
             continue
+        pending[file_path] = (current_hash, stat.st_size, stat.st_mtime_ns, row is not None)
+    conn.commit()
+
+    # 4. Parse in worker processes, embed and upload as each file is ready
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+        for file_path, future in iter_parsed(pool, pending):
+            current_hash, size, mtime_ns, known = pending[file_path]
+            logger.info(f"Processing {file_path.name}...")
+
+            try:
+                text = future.result()
+            except Exception as e:
+                logger.error(f"Error parsing {file_path}: {e}")
+                continue
+                
+            if not text.strip():
+                logger.warning(f"No text extracted from {file_path}")
+                continue
+                
+            chunks = chunk_text(text)
             
-        chunks = chunk_text(text)
-        
-        if row:
-            delete_file_chunks(client, file_path.name)
+            if known:
+                delete_file_chunks(client, file_path.name)
+                
+            upload_chunks(client, chunks, file_path.name)
             
-        upload_chunks(client, chunks, file_path.name)
-        
-        c.execute("INSERT OR REPLACE INTO files (path, hash, last_updated) VALUES (?, ?, CURRENT_TIMESTAMP)",
-                  (str_path, current_hash))
-        conn.commit()
+            c.execute("INSERT OR REPLACE INTO files (path, hash, last_updated, size, mtime_ns) "
+                      "VALUES (?, ?, CURRENT_TIMESTAMP, ?, ?)",
+                      (str(file_path), current_hash, size, mtime_ns))
+            conn.commit()
+            # rag-chat drops its caches when the stamp moves, so it must only move once the points are searchable
+            wait_for_updates(client)
+            touch_ingest_stamp()
 
-    conn.close()
+def process_docs(docs_dir: Path):
+    conn = init_db()
+    client = get_qdrant_client()
+    restore_indexing = ensure_collection(client)
+    try:
+        ingest_files(conn, client, docs_dir)
+    finally:
+        # Also on failure: a collection left at indexing_threshold=0 would be searched without HNSW
+        if restore_indexing:
+            enable_indexing(client)
+        conn.close()
     logger.info("Ingestion complete.")
 
 if __name__ == "__main__":
+    # chunk_text steps by CHUNK_SIZE - CHUNK_OVERLAP: zero fails in range(), negative silently yields no chunks
+    if not 0 <= CHUNK_OVERLAP < CHUNK_SIZE:
+        logger.error(f"Invalid chunking config: need 0 <= CHUNK_OVERLAP < CHUNK_SIZE, "
+                     f"got CHUNK_SIZE={CHUNK_SIZE}, CHUNK_OVERLAP={CHUNK_OVERLAP}")
+        sys.exit(1)
     target_dir = Path(DOCS_DIR)
     if not target_dir.exists():
         logger.warning(f"Docs dir {target_dir} does not exist.")
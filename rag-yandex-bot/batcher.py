@@ -0,0 +1,105 @@
+"""
+Micro-batching of concurrent async calls
+Collects requests from concurrent handlers for a short window and serves them with one batched call
+
+Twin of rag-chat/batcher.py (each service is its own Docker build context); keep the code of both copies in sync.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent submit() calls into batched handler calls
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        window: float,
+        max_batch: int,
+        max_in_flight: Optional[int] = None,
+        split_on_error: bool = False
+    ):
+        """
+        Initialize batcher
+
+        Args:
+            handler: Async callable mapping a list of items to a list of results in the same order
+            window: Seconds to wait for more items before flushing a batch
+            max_batch: Max number of items per handler call
+            max_in_flight: Max number of concurrent handler calls (unbounded if None)
+            split_on_error: Retry a failed batch item by item, so only the offending item gets the error
+        """
+        self._handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self._in_flight = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self.split_on_error = split_on_error
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # Strong references to running batches so they are not garbage-collected mid-call
+        self._batch_tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue item for the next batch and wait for its result
+
+        Args:
+            item: Single handler input
+
+        Returns:
+            Handler result for this item; handler exceptions are re-raised
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                await asyncio.sleep(self.window)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                # Each batch runs in its own task so items arriving meanwhile are not held behind it
+                task = asyncio.create_task(self._run(batch))
+                self._batch_tasks.add(task)
+                task.add_done_callback(self._batch_tasks.discard)
+        except asyncio.CancelledError:
+            # Do not leave waiters hanging if the flusher is cancelled on shutdown
+            for _, future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            raise
+
+    async def _call(self, items: List[Any]) -> List[Any]:
+        if self._in_flight is None:
+            return await self._handler(items)
+        async with self._in_flight:
+            return await self._handler(items)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        try:
+            results = await self._call([item for item, _ in batch])
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            if self.split_on_error and len(batch) > 1:
+                logger.warning(f"Batched call failed for {len(batch)} items, retrying one by one: {e}")
+                await asyncio.gather(*(self._run([entry]) for entry in batch))
+                return
+            logger.error(f"Batched call failed for {len(batch)} items: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
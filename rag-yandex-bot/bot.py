@@ -5,18 +5,28 @@ Main bot entry point with polling and file processing
 import os
 import sys
 import asyncio
+import base64
+import hashlib
 import logging
 import aiohttp
+import numpy as np
+import orjson
+import uvloop
+from functools import lru_cache
 from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
 from yandex_api import YandexMessengerClient
 # from workflow import FileProcessor # Keeping these for now if needed, but RAG is priority
-# from email_sender import EmailSender
-from health_server import start_health_server
+# from email_sender import get_email_sender
+from email_sender import close_email_sender
+from health_server import register_stats, start_health_server
+from cache import BoundedDict, TTLCache, embedding_key, question_key
+from batcher import MicroBatcher
 # from llm_integration import create_llm_keyboard, request_analysis
+from llm_integration import close_session as close_llm_session
 
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, models
 from openai import AsyncOpenAI
 
 # Load environment variables
@@ -42,30 +52,95 @@ if not YANDEX_BOT_TOKEN:
 # RAG Configuration
 QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "true").lower() == "true"
 QDRANT_COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "internal_regulations_v2")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_EMBEDDING_MODEL = os.getenv("OPENROUTER_EMBEDDING_MODEL", "google/gemini-embedding-001")
 RAG_BOT_ENDPOINT = os.getenv("RAG_BOT_ENDPOINT", "http://rag-bot:8000/generate_answer")
 SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", 5))
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", 128))
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", 3.0))
+# Max questions processed concurrently (embedding + search + LLM)
+RAG_CONCURRENCY = int(os.getenv("RAG_CONCURRENCY", 32))
+# Idle polling backoff bounds (sec)
+POLL_MIN_DELAY = float(os.getenv("POLL_MIN_DELAY", 0.05))
+POLL_MAX_DELAY = float(os.getenv("POLL_MAX_DELAY", 1.0))
+# Repeated questions skip the embeddings round-trip to OpenRouter
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 1024))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", 3600))
+# Cache misses from concurrent handlers within this window (sec) go to OpenRouter as one request
+EMBEDDING_BATCH_WINDOW = float(os.getenv("EMBEDDING_BATCH_WINDOW", 0.015))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", 64))
+# Qdrant search results by (float16-rounded) question embedding
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1024))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 20))
+# Searches from concurrent handlers within this window (sec) go to Qdrant as one search_batch
+SEARCH_BATCH_WINDOW = float(os.getenv("SEARCH_BATCH_WINDOW", 0.005))
+SEARCH_MAX_BATCH = int(os.getenv("SEARCH_MAX_BATCH", 16))
+
+# Shared volume with transcripts for the LLM analyzer; created once at startup
+TRANSCRIPTS_DIR = "/app/shared/transcripts"
+os.makedirs(TRANSCRIPTS_DIR, exist_ok=True)
 
 # Clients
-qdrant_client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+# Async client: an in-flight search no longer blocks other handlers on the event loop
+qdrant_client = AsyncQdrantClient(
+    host=QDRANT_HOST,
+    port=QDRANT_PORT,
+    grpc_port=QDRANT_GRPC_PORT,
+    prefer_grpc=QDRANT_PREFER_GRPC
+)
 openai_client = AsyncOpenAI(
     api_key=OPENROUTER_API_KEY,
     base_url="https://openrouter.ai/api/v1"
 ) if OPENROUTER_API_KEY else None
 
+# Shared HTTP session for rag-bot calls: keep-alive connections are reused across questions
+_http_session: Optional[aiohttp.ClientSession] = None
+
+rag_semaphore = asyncio.Semaphore(RAG_CONCURRENCY)
+
+# Handler tasks in flight: asyncio keeps only weak references to tasks, so they are held here
+_handler_tasks = set()
+
+embedding_cache = TTLCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL)
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+register_stats("embedding_cache", embedding_cache.stats)
+register_stats("search_cache", search_cache.stats)
+
 # Track processing state per chat
+# (only chats with a file in progress are kept; the entry is removed when processing ends)
 processing_chats: Dict[str, bool] = {}
 
 # Track last processed JSON file path per chat (for LLM callbacks)
-last_json_files: Dict[str, str] = {}
+last_json_files: Dict[str, str] = BoundedDict(5_000)
 
 # Track hash -> filename mapping for short callback_data
-file_hash_mapping: Dict[str, str] = {}
+file_hash_mapping: Dict[str, str] = BoundedDict(20_000)
 
 # Track completed analyses per file_hash: {file_hash: set(analysis_types)}
-completed_analyses: Dict[str, set] = {}
+completed_analyses: Dict[str, set] = BoundedDict(20_000)
+
+
+@lru_cache(maxsize=4096)
+def _hash_name(name: str) -> str:
+    """Short (8 hex chars) stable id for a transcript file name, used in callback_data"""
+    return hashlib.blake2b(name.encode(), digest_size=4).hexdigest()
+
+
+def _on_handler_done(task: asyncio.Task):
+    _handler_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Handler task failed", exc_info=task.exception())
+
+
+def spawn_handler(coro) -> asyncio.Task:
+    """Run a message handler in the background, keeping a reference and logging uncaught errors"""
+    task = asyncio.create_task(coro)
+    _handler_tasks.add(task)
+    task.add_done_callback(_on_handler_done)
+    return task
 
 
 async def handle_file_message(client: YandexMessengerClient, message: dict):
@@ -139,7 +214,10 @@ async def handle_file_message(client: YandexMessengerClient, message: dict):
             """Send status updates to user"""
             await client.send_message(chat_id, status)
 
-        result = await processor.process_file(file_path, file_name, status_callback)
+        try:
+            result = await processor.process_file(file_path, file_name, status_callback)
+        finally:
+            await processor.close()
 
         if result["status"] == "success":
             # Extract user email from message (from Yandex login)
@@ -154,26 +232,22 @@ async def handle_file_message(client: YandexMessengerClient, message: dict):
                 return  # Will trigger finally block
 
             # Save JSON to shared volume for LLM analysis
-            import json
-            import hashlib
-            json_dir = "/app/shared/transcripts"
-            os.makedirs(json_dir, exist_ok=True)
-
             # Create unique filename
             base_name = os.path.splitext(file_name)[0]
             json_filename = f"{base_name}_transcript.json"
-            json_path = os.path.join(json_dir, json_filename)
+            json_path = os.path.join(TRANSCRIPTS_DIR, json_filename)
 
             try:
-                with open(json_path, 'w', encoding='utf-8') as f:
-                    json.dump(result["result"], f, ensure_ascii=False, indent=2)
+                # Compact UTF-8 JSON: no indentation on the request path, same content for the analyzer
+                with open(json_path, 'wb') as f:
+                    f.write(orjson.dumps(result["result"]))
                 logger.info(f"Transcript saved to: {json_path}")
 
                 # Store JSON path for this chat (for LLM callbacks)
                 last_json_files[chat_id] = json_path
 
                 # Store hash mapping for short callback_data
-                file_hash = hashlib.md5(json_filename.encode()).hexdigest()[:8]
+                file_hash = _hash_name(json_filename)
                 file_hash_mapping[file_hash] = json_path
                 logger.debug(f"Hash mapping: {file_hash} -> {json_path}")
             except Exception as e:
@@ -193,7 +267,7 @@ async def handle_file_message(client: YandexMessengerClient, message: dict):
             )
 
             # Send result via email to user's address
-            email_sender = EmailSender()
+            email_sender = get_email_sender()
             email_sent = await email_sender.send_result(
                 result["result"],
                 file_name,
@@ -236,7 +310,7 @@ async def handle_file_message(client: YandexMessengerClient, message: dict):
 
     finally:
         # Release processing lock
-        processing_chats[chat_id] = False
+        processing_chats.pop(chat_id, None)
 
 
 async def handle_callback_query(client: YandexMessengerClient, callback_query: dict):
@@ -248,6 +322,96 @@ async def handle_callback_query(client: YandexMessengerClient, callback_query: d
         await client.send_message(chat_id, "⚠️ Эта функция временно недоступна в режиме RAG-бота.")
 
 
+async def get_http_session() -> aiohttp.ClientSession:
+    """Get or create the shared aiohttp session"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=32, keepalive_timeout=75, ttl_dns_cache=300),
+            # aiohttp expects a str from json_serialize
+            json_serialize=lambda obj: orjson.dumps(obj).decode()
+        )
+    return _http_session
+
+
+def _to_vector(embedding) -> np.ndarray:
+    """Decode a base64 float32 embedding; providers that ignore encoding_format return a float list"""
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype=np.float32)
+    return np.asarray(embedding, dtype=np.float32)
+
+
+async def _embed_batch(texts: List[str]) -> List[np.ndarray]:
+    """
+    Get embeddings for several questions in one OpenRouter request
+
+    Vectors are kept as float32 arrays: ~4 bytes per dimension in the cache instead of a boxed Python float
+    """
+    # base64 is ~4x smaller than a JSON float array and decodes straight into float32 without per-float parsing
+    embedding_resp = await openai_client.embeddings.create(
+        model=OPENROUTER_EMBEDDING_MODEL,
+        input=texts,
+        encoding_format="base64"
+    )
+    return [_to_vector(item.embedding) for item in sorted(embedding_resp.data, key=lambda d: d.index)]
+
+
+# One rejected input (e.g. an over-length message) must not fail the other questions in its batch
+embedding_batcher = MicroBatcher(_embed_batch, EMBEDDING_BATCH_WINDOW, EMBEDDING_MAX_BATCH, split_on_error=True)
+
+
+async def get_embedding(text: str) -> np.ndarray:
+    """
+    Get question embedding via OpenRouter, cached by normalized question text;
+    cache misses from concurrent handlers are embedded in one batch
+    """
+    key = question_key(text)
+    embedding = embedding_cache.get(key)
+    if embedding is None:
+        embedding = await embedding_batcher.submit(text)
+        embedding_cache.set(key, embedding)
+    return embedding
+
+
+# Candidates are selected on the quantized vectors (set up by rag-ingest) and rescored on the originals
+_SEARCH_PARAMS = models.SearchParams(
+    hnsw_ef=QDRANT_HNSW_EF,
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=QDRANT_OVERSAMPLING)
+)
+
+
+async def _search_batch(embeddings: List[np.ndarray]) -> List[List[dict]]:
+    """
+    Search Qdrant for several question embeddings in one request
+
+    Returns:
+        Context list (text + source file) per embedding, in input order
+    """
+    batch_results = await qdrant_client.search_batch(
+        collection_name=QDRANT_COLLECTION_NAME,
+        requests=[
+            # SearchRequest validates the vector as a list of floats
+            models.SearchRequest(
+                vector=embedding.tolist(),
+                limit=SEARCH_LIMIT,
+                with_payload=True,
+                params=_SEARCH_PARAMS
+            )
+            for embedding in embeddings
+        ]
+    )
+    return [
+        [
+            {"text": result.payload['text'], "file": result.payload.get('source_file', 'unknown')}
+            for result in search_results
+        ]
+        for search_results in batch_results
+    ]
+
+
+search_batcher = MicroBatcher(_search_batch, SEARCH_BATCH_WINDOW, SEARCH_MAX_BATCH)
+
+
 async def handle_text_message(client: YandexMessengerClient, message: dict):
     """
     Handle incoming text message from user (RAG Chat)
@@ -279,48 +443,39 @@ async def handle_text_message(client: YandexMessengerClient, message: dict):
     try:
         await client.send_message(chat_id, "🔍 Ищу информацию...")
         
-        # 1. Get Embedding
-        if not openai_client:
-            await client.send_message(chat_id, "❌ Ошибка: OpenAI клиент не настроен.")
-            return
-
-        embedding_resp = await openai_client.embeddings.create(
-            model=OPENROUTER_EMBEDDING_MODEL,
-            input=text
-        )
-        question_embedding = embedding_resp.data[0].embedding
-
-        # 2. Search Qdrant
-        search_results = qdrant_client.search(
-            collection_name=QDRANT_COLLECTION_NAME,
-            query_vector=question_embedding,
-            limit=SEARCH_LIMIT,
-            with_payload=True
-        )
-
-        if not search_results:
-            await client.send_message(chat_id, "⚠️ К сожалению, я не нашел информации по вашему вопросу в базе знаний.")
-            return
-
-        # Prepare context
-        context = [
-            {"text": result.payload['text'], "file": result.payload.get('source_file', 'unknown')}
-            for result in search_results
-        ]
+        # Limit in-flight RAG work so a burst of messages does not trip provider rate limits
+        async with rag_semaphore:
+            # 1. Get Embedding
+            if not openai_client:
+                await client.send_message(chat_id, "❌ Ошибка: OpenAI клиент не настроен.")
+                return
+
+            question_embedding = await get_embedding(text)
+
+            # 2. Search Qdrant
+            search_key = embedding_key(question_embedding)
+            context = search_cache.get(search_key)
+            if context is None:
+                context = await search_batcher.submit(question_embedding)
+                search_cache.set(search_key, context)
+
+            if not context:
+                await client.send_message(chat_id, "⚠️ К сожалению, я не нашел информации по вашему вопросу в базе знаний.")
+                return
         
-        # 3. Call RAG-Bot (LLM)
-        payload = {
-            "question": text,
-            "context": context,
-            "model_provider": "openai"
-        }
+            # 3. Call RAG-Bot (LLM)
+            payload = {
+                "question": text,
+                "context": context,
+                "model_provider": "openai"
+            }
         
-        async with aiohttp.ClientSession() as session:
+            session = await get_http_session()
             async with session.post(RAG_BOT_ENDPOINT, json=payload, timeout=60) as response:
                 if response.status == 200:
-                    result = await response.json()
+                    result = await response.json(loads=orjson.loads)
                     answer = result.get("answer", "Пустой ответ от LLM")
-                    
+                
                     # 4. Send Answer
                     final_message = answer
                     await client.send_message(chat_id, final_message)
@@ -357,16 +512,21 @@ async def main():
     logger.info("Bot started successfully. Polling for updates...")
 
     offset = 0
+    # getUpdates may return immediately when the queue is empty, so idle polls back off
+    # exponentially up to POLL_MAX_DELAY and reset as soon as an update arrives
+    poll_delay = POLL_MIN_DELAY
 
     try:
         while True:
             try:
-                # Get updates
+                # Get updates (the API holds the request up to `timeout` seconds where long polling is honored)
                 updates = await client.get_updates(offset=offset, limit=10)
 
                 if not updates:
-                    await asyncio.sleep(1)
+                    await asyncio.sleep(poll_delay)
+                    poll_delay = min(poll_delay * 2, POLL_MAX_DELAY)
                     continue
+                poll_delay = POLL_MIN_DELAY
 
                 for update in updates:
                     # Log raw update for debugging
@@ -380,14 +540,14 @@ async def main():
 
                     # Check for text message
                     if "text" in message:
-                        asyncio.create_task(handle_text_message(client, message))
+                        spawn_handler(handle_text_message(client, message))
                     elif "file" in message or "voice" in message:
                          # Stub for file handling if dependencies are missing
                          chat_id = message.get("from", {}).get("login")
                          if chat_id:
                              await client.send_message(chat_id, "⚠️ Обработка файлов временно отключена.")
                     elif "callback_data" in message:
-                        asyncio.create_task(handle_callback_query(client, message))
+                        spawn_handler(handle_callback_query(client, message))
 
             except Exception as e:
                 logger.error(f"Error in polling loop: {e}", exc_info=True)
@@ -396,6 +556,17 @@ async def main():
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
 
+    finally:
+        for task in list(_handler_tasks):
+            task.cancel()
+        await asyncio.gather(*_handler_tasks, return_exceptions=True)
+        await client.close()
+        if _http_session and not _http_session.closed:
+            await _http_session.close()
+        await close_email_sender()
+        await close_llm_session()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # libuv event loop: cheaper per-socket overhead for the polling, RAG and upload traffic
+    uvloop.run(main())
@@ -0,0 +1,81 @@
+"""
+Caches for rag-yandex-bot
+
+TTLCache - LRU cache with expiring entries: question embeddings (keyed by normalized
+question text) and Qdrant search results (keyed by embedding).
+BoundedDict - chat/file state dict that evicts the oldest entries.
+
+embedding_key, normalize_question, question_key and TTLCache have a twin in
+rag-chat/cache.py (each service is its own Docker build context); keep the code of both copies in sync.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def embedding_key(embedding: List[float]) -> bytes:
+    """Embedding key; rounding to float16 merges vectors that differ only by low-order noise"""
+    return hashlib.blake2b(np.asarray(embedding, dtype=np.float16).tobytes(), digest_size=16).digest()
+
+
+def normalize_question(question: str) -> str:
+    """Canonical form of a question: case and repeated whitespace do not matter"""
+    return " ".join(question.split()).casefold()
+
+
+def question_key(question: str) -> bytes:
+    """Fixed-size key of the normalized question text"""
+    return hashlib.blake2b(normalize_question(question).encode("utf-8"), digest_size=16).digest()
+
+
+class TTLCache:
+    """LRU cache with a time-to-live per entry; counts hits and misses for /health"""
+
+    def __init__(self, max_items: int, ttl_sec: float):
+        self.max_items = max_items
+        self.ttl_sec = ttl_sec
+        self._data: "OrderedDict[bytes, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if time.monotonic() - entry[0] > self.ttl_sec:
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: bytes, value: Any) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_items:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class BoundedDict(OrderedDict):
+    """Dict with a bounded number of entries: on overflow the least recently written ones are dropped"""
+
+    def __init__(self, max_items: int):
+        super().__init__()
+        self.max_items = max_items
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.max_items:
+            self.popitem(last=False)
@@ -3,87 +3,34 @@ Email Sender Module
 Sends recognition results via Yandex SMTP
 """
 import os
+import asyncio
 import logging
-import json
-import smtplib
+import aiosmtplib
+import orjson
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
-from typing import Dict
+from html import escape
+from string import Template
+from typing import Dict, Optional
 
 logger = logging.getLogger(__name__)
 
-
-class EmailSender:
-    """
-    Sends emails via Yandex SMTP
-    """
-
-    def __init__(self):
-        """Initialize email sender with configuration from environment"""
-        self.smtp_host = os.getenv("SMTP_HOST", "smtp.yandex.ru")
-        self.smtp_port = int(os.getenv("SMTP_PORT", "587"))
-        self.smtp_use_tls = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
-        self.smtp_user = os.getenv("SMTP_USER")
-        self.smtp_password = os.getenv("SMTP_PASSWORD")
-
-        # Validate configuration
-        if not self.smtp_user or not self.smtp_password:
-            logger.error("SMTP credentials not configured")
-
-    def _create_email_body(self, result: dict, file_name: str) -> str:
-        """
-        Create HTML email body with result summary
-
-        Args:
-            result: Recognition result dict
-            file_name: Original file name
-
-        Returns:
-            HTML string
-        """
-        metadata = result.get("metadata", {})
-        segments = result.get("segments", [])
-
-        # Create segments preview (first 5 segments)
-        segments_preview = ""
-        for i, seg in enumerate(segments[:5]):
-            speaker = seg.get("speaker", "Unknown")
-            text = seg.get("text", "")
-            start = seg.get("start", 0)
-            end = seg.get("end", 0)
-
-            segments_preview += f"""
-            <tr>
-                <td style="padding: 8px; border: 1px solid #ddd;">{speaker}</td>
-                <td style="padding: 8px; border: 1px solid #ddd;">{start:.2f}s - {end:.2f}s</td>
-                <td style="padding: 8px; border: 1px solid #ddd;">{text}</td>
-            </tr>
-            """
-
-        if len(segments) > 5:
-            segments_preview += f"""
-            <tr>
-                <td colspan="3" style="padding: 8px; border: 1px solid #ddd; text-align: center; font-style: italic;">
-                    ... и ещё {len(segments) - 5} сегментов (см. прикреплённый JSON файл)
-                </td>
-            </tr>
-            """
-
-        html_body = f"""
+# Email HTML is rendered from precompiled templates; user-provided values are HTML-escaped
+_EMAIL_TEMPLATE = Template("""
         <html>
         <head>
             <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 800px; margin: 0 auto; padding: 20px; }}
-                h1 {{ color: #2c3e50; border-bottom: 2px solid #3498db; padding-bottom: 10px; }}
-                h2 {{ color: #34495e; margin-top: 30px; }}
-                table {{ border-collapse: collapse; width: 100%; margin-top: 15px; }}
-                th {{ background-color: #3498db; color: white; padding: 12px; text-align: left; }}
-                td {{ padding: 8px; border: 1px solid #ddd; }}
-                .metadata {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-                .metadata-item {{ margin: 8px 0; }}
-                .label {{ font-weight: bold; color: #2c3e50; }}
+                body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+                .container { max-width: 800px; margin: 0 auto; padding: 20px; }
+                h1 { color: #2c3e50; border-bottom: 2px solid #3498db; padding-bottom: 10px; }
+                h2 { color: #34495e; margin-top: 30px; }
+                table { border-collapse: collapse; width: 100%; margin-top: 15px; }
+                th { background-color: #3498db; color: white; padding: 12px; text-align: left; }
+                td { padding: 8px; border: 1px solid #ddd; }
+                .metadata { background-color: #f8f9fa; padding: 15px; border-radius: 5px; margin: 20px 0; }
+                .metadata-item { margin: 8px 0; }
+                .label { font-weight: bold; color: #2c3e50; }
             </style>
         </head>
         <body>
@@ -92,14 +39,14 @@ class EmailSender:
 
                 <div class="metadata">
                     <h2>📊 Метаданные</h2>
-                    <div class="metadata-item"><span class="label">Файл:</span> {file_name}</div>
-                    <div class="metadata-item"><span class="label">Время обработки:</span> {metadata.get('processing_time', 'N/A')}</div>
-                    <div class="metadata-item"><span class="label">Модель:</span> {metadata.get('model', 'N/A')}</div>
-                    <div class="metadata-item"><span class="label">Устройство:</span> {metadata.get('device', 'N/A')}</div>
-                    <div class="metadata-item"><span class="label">Язык:</span> {metadata.get('language', 'N/A')}</div>
-                    <div class="metadata-item"><span class="label">Сегментов:</span> {metadata.get('num_segments', 0)}</div>
-                    <div class="metadata-item"><span class="label">Спикеров:</span> {metadata.get('num_speakers', 0)}</div>
-                    <div class="metadata-item"><span class="label">Символов текста:</span> {metadata.get('total_text_length', 0)}</div>
+                    <div class="metadata-item"><span class="label">Файл:</span> $file_name</div>
+                    <div class="metadata-item"><span class="label">Время обработки:</span> $processing_time</div>
+                    <div class="metadata-item"><span class="label">Модель:</span> $model</div>
+                    <div class="metadata-item"><span class="label">Устройство:</span> $device</div>
+                    <div class="metadata-item"><span class="label">Язык:</span> $language</div>
+                    <div class="metadata-item"><span class="label">Сегментов:</span> $num_segments</div>
+                    <div class="metadata-item"><span class="label">Спикеров:</span> $num_speakers</div>
+                    <div class="metadata-item"><span class="label">Символов текста:</span> $total_text_length</div>
                 </div>
 
                 <h2>📝 Сегменты (предпросмотр)</h2>
@@ -112,7 +59,7 @@ class EmailSender:
                         </tr>
                     </thead>
                     <tbody>
-                        {segments_preview}
+                        $segments_preview
                     </tbody>
                 </table>
 
@@ -126,7 +73,133 @@ class EmailSender:
             </div>
         </body>
         </html>
+        """)
+
+_SEGMENT_TEMPLATE = Template("""
+            <tr>
+                <td style="padding: 8px; border: 1px solid #ddd;">$speaker</td>
+                <td style="padding: 8px; border: 1px solid #ddd;">$start</td>
+                <td style="padding: 8px; border: 1px solid #ddd;">$text</td>
+            </tr>
+            """)
+
+_MORE_SEGMENTS_TEMPLATE = Template("""
+            <tr>
+                <td colspan="3" style="padding: 8px; border: 1px solid #ddd; text-align: center; font-style: italic;">
+                    ... и ещё $count сегментов (см. прикреплённый JSON файл)
+                </td>
+            </tr>
+            """)
+
+
+class EmailSender:
+    """
+    Sends emails via Yandex SMTP
+    """
+
+    def __init__(self):
+        """Initialize email sender with configuration from environment"""
+        self.smtp_host = os.getenv("SMTP_HOST", "smtp.yandex.ru")
+        self.smtp_port = int(os.getenv("SMTP_PORT", "587"))
+        self.smtp_use_tls = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+        self.smtp_user = os.getenv("SMTP_USER")
+        self.smtp_password = os.getenv("SMTP_PASSWORD")
+
+        # Validate configuration
+        if not self.smtp_user or not self.smtp_password:
+            logger.error("SMTP credentials not configured")
+
+        # One authenticated connection is reused across sends; the lock serializes SMTP transactions
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._lock = asyncio.Lock()
+
+    async def _get_smtp(self) -> aiosmtplib.SMTP:
+        """Return the connected and authenticated SMTP client, (re)connecting if needed"""
+        if self._smtp is None or not self._smtp.is_connected:
+            smtp = aiosmtplib.SMTP(
+                hostname=self.smtp_host,
+                port=self.smtp_port,
+                start_tls=self.smtp_use_tls
+            )
+            await smtp.connect()
+            try:
+                await smtp.login(self.smtp_user, self.smtp_password)
+            except Exception:
+                # Not stored in self._smtp yet, so _drop_connection could not close it
+                smtp.close()
+                raise
+            self._smtp = smtp
+        return self._smtp
+
+    def _drop_connection(self):
+        """Forget the current connection so the next send reconnects"""
+        if self._smtp is not None:
+            self._smtp.close()
+            self._smtp = None
+
+    async def _send(self, msg: MIMEMultipart):
+        """Send message over the shared connection, reconnecting once if the server dropped it"""
+        async with self._lock:
+            try:
+                smtp = await self._get_smtp()
+                await smtp.send_message(msg)
+            except aiosmtplib.SMTPServerDisconnected:
+                # Server closed the idle connection (e.g. Yandex idle timeout): reconnect and retry once
+                self._drop_connection()
+                smtp = await self._get_smtp()
+                await smtp.send_message(msg)
+            except Exception:
+                self._drop_connection()
+                raise
+
+    async def close(self):
+        """Close the shared SMTP connection"""
+        async with self._lock:
+            if self._smtp is not None and self._smtp.is_connected:
+                try:
+                    await self._smtp.quit()
+                except aiosmtplib.SMTPException:
+                    pass
+            self._drop_connection()
+
+    def _create_email_body(self, result: dict, file_name: str) -> str:
         """
+        Create HTML email body with result summary
+
+        Args:
+            result: Recognition result dict
+            file_name: Original file name
+
+        Returns:
+            HTML string
+        """
+        metadata = result.get("metadata", {})
+        segments = result.get("segments", [])
+
+        # Create segments preview (first 5 segments)
+        segments_preview = "".join(
+            _SEGMENT_TEMPLATE.substitute(
+                speaker=escape(str(seg.get("speaker", "Unknown"))),
+                start=f"{seg.get('start', 0):.2f}s - {seg.get('end', 0):.2f}s",
+                text=escape(str(seg.get("text", "")))
+            )
+            for seg in segments[:5]
+        )
+
+        if len(segments) > 5:
+            segments_preview += _MORE_SEGMENTS_TEMPLATE.substitute(count=len(segments) - 5)
+
+        html_body = _EMAIL_TEMPLATE.substitute(
+            file_name=escape(file_name),
+            processing_time=escape(str(metadata.get('processing_time', 'N/A'))),
+            model=escape(str(metadata.get('model', 'N/A'))),
+            device=escape(str(metadata.get('device', 'N/A'))),
+            language=escape(str(metadata.get('language', 'N/A'))),
+            num_segments=metadata.get('num_segments', 0),
+            num_speakers=metadata.get('num_speakers', 0),
+            total_text_length=metadata.get('total_text_length', 0),
+            segments_preview=segments_preview
+        )
 
         return html_body
 
@@ -165,12 +238,13 @@ class EmailSender:
             msg.attach(html_part)
 
             # Attach JSON file using MIMEApplication (correct way for Yandex SMTP)
-            json_data = json.dumps(result, ensure_ascii=False, indent=2)
+            # orjson writes UTF-8 directly (same as ensure_ascii=False) and indents natively
+            json_data = orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
             json_filename = f"{os.path.splitext(file_name)[0]}_result.json"
 
             # Create MIMEApplication part for JSON with base64 encoding
             json_part = MIMEApplication(
-                json_data.encode('utf-8'),
+                json_data,
                 _subtype='json',
                 Name=json_filename  # CRITICAL: Name parameter for email clients
             )
@@ -184,13 +258,8 @@ class EmailSender:
 
             msg.attach(json_part)
 
-            # Send email
-            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                if self.smtp_use_tls:
-                    server.starttls()
-
-                server.login(self.smtp_user, self.smtp_password)
-                server.send_message(msg)
+            # Send email without blocking the event loop
+            await self._send(msg)
 
             logger.info(f"Email sent successfully to {recipient_email}")
             return True
@@ -198,3 +267,20 @@ class EmailSender:
         except Exception as e:
             logger.error(f"Failed to send email: {e}", exc_info=True)
             return False
+
+
+_default_sender: Optional[EmailSender] = None
+
+
+def get_email_sender() -> EmailSender:
+    """Shared EmailSender, so its SMTP connection is reused across results"""
+    global _default_sender
+    if _default_sender is None:
+        _default_sender = EmailSender()
+    return _default_sender
+
+
+async def close_email_sender():
+    """Close the shared sender's SMTP connection if one was opened"""
+    if _default_sender is not None:
+        await _default_sender.close()
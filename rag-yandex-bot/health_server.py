@@ -2,8 +2,28 @@
 Simple HTTP health check server for Docker health checks
 Runs alongside the bot in a separate thread
 """
+import json
 import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict
+
+_HEALTH_STATUS = {"status": "healthy", "service": "yandex_bot"}
+# Response body when no stats are registered, encoded once
+_HEALTH_BODY = json.dumps(_HEALTH_STATUS).encode()
+
+# name -> callable returning extra stats for the /health response body
+_stats_providers: Dict[str, Callable[[], dict]] = {}
+
+
+def register_stats(name: str, provider: Callable[[], dict]):
+    """
+    Include provider() output under `name` in the /health response
+
+    Args:
+        name: Key in the response body
+        provider: Callable returning a JSON-serializable dict
+    """
+    _stats_providers[name] = provider
 
 
 class HealthCheckHandler(BaseHTTPRequestHandler):
@@ -15,7 +35,13 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
             self.send_response(200)
             self.send_header("Content-type", "application/json")
             self.end_headers()
-            self.wfile.write(b'{"status": "healthy", "service": "yandex_bot"}')
+            if _stats_providers:
+                body = dict(_HEALTH_STATUS)
+                for name, provider in list(_stats_providers.items()):
+                    body[name] = provider()
+                self.wfile.write(json.dumps(body).encode())
+            else:
+                self.wfile.write(_HEALTH_BODY)
         else:
             self.send_response(404)
             self.end_headers()
@@ -32,7 +58,8 @@ def start_health_server(port=8003):
     Args:
         port: Port to listen on
     """
-    server = HTTPServer(("0.0.0.0", port), HealthCheckHandler)
+    # One thread per request: concurrent probes are not queued behind each other
+    server = ThreadingHTTPServer(("0.0.0.0", port), HealthCheckHandler)
 
     def run():
         server.serve_forever()
@@ -6,12 +6,34 @@ import os
 import json
 import logging
 import aiohttp
+import orjson
 from typing import Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
 
 LLM_ANALYZER_URL = os.getenv("LLM_ANALYZER_URL", "http://llm_analyzer:8005")
 
+# Shared HTTP session: keep-alive connections to the analyzer are reused across requests
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Get or create the shared aiohttp session"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=32, keepalive_timeout=75, ttl_dns_cache=300),
+            # aiohttp expects a str from json_serialize
+            json_serialize=lambda obj: orjson.dumps(obj).decode()
+        )
+    return _session
+
+
+async def close_session():
+    """Close the shared session"""
+    if _session and not _session.closed:
+        await _session.close()
+
 
 async def request_analysis(json_file_path: str, analysis_type: str) -> Dict[str, Any]:
     """
@@ -25,30 +47,30 @@ async def request_analysis(json_file_path: str, analysis_type: str) -> Dict[str,
         Analysis result dict with status and result/error
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "json_file_path": json_file_path,
-                "analysis_type": analysis_type
-            }
+        session = await get_session()
+        payload = {
+            "json_file_path": json_file_path,
+            "analysis_type": analysis_type
+        }
 
-            logger.info(f"Requesting {analysis_type} analysis for {json_file_path}")
-
-            async with session.post(
-                f"{LLM_ANALYZER_URL}/analyze",
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=180)  # 3 minutes timeout for LLM
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    logger.info(f"Analysis completed: {analysis_type}")
-                    return result
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Analysis failed: {response.status} - {error_text}")
-                    return {
-                        "status": "error",
-                        "error": f"HTTP {response.status}: {error_text}"
-                    }
+        logger.info(f"Requesting {analysis_type} analysis for {json_file_path}")
+
+        async with session.post(
+            f"{LLM_ANALYZER_URL}/analyze",
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=180)  # 3 minutes timeout for LLM
+        ) as response:
+            if response.status == 200:
+                result = await response.json(loads=orjson.loads)
+                logger.info(f"Analysis completed: {analysis_type}")
+                return result
+            else:
+                error_text = await response.text()
+                logger.error(f"Analysis failed: {response.status} - {error_text}")
+                return {
+                    "status": "error",
+                    "error": f"HTTP {response.status}: {error_text}"
+                }
 
     except aiohttp.ClientTimeout:
         logger.error(f"Analysis timeout for {analysis_type}")
@@ -64,6 +86,15 @@ async def request_analysis(json_file_path: str, analysis_type: str) -> Dict[str,
         }
 
 
+# All available analysis buttons: (text, action)
+_LLM_BUTTONS = (
+    ("📝 Саммаризация", "summarize"),
+    ("⚖️ Позиции сторон", "positions"),
+    ("✅ Задачи и ответственные", "tasks"),
+    ("🔄 Enhanced JSON", "enhance_json"),
+)
+
+
 def create_llm_keyboard(json_file_path: str, file_hash: str, exclude_actions: set = None) -> list:
     """
     Create inline keyboard with LLM analysis options
@@ -79,42 +110,18 @@ def create_llm_keyboard(json_file_path: str, file_hash: str, exclude_actions: se
     if exclude_actions is None:
         exclude_actions = set()
 
-    logger.info(f"create_llm_keyboard called with file_hash={file_hash}, exclude_actions: {exclude_actions}")
-
-    # All available buttons
-    all_buttons = [
-        {
-            "text": "📝 Саммаризация",
-            "action": "summarize",
-        },
-        {
-            "text": "⚖️ Позиции сторон",
-            "action": "positions",
-        },
+    keyboard = [
         {
-            "text": "✅ Задачи и ответственные",
-            "action": "tasks",
-        },
-        {
-            "text": "🔄 Enhanced JSON",
-            "action": "enhance_json",
+            "text": text,
+            "callback_data": {
+                "action": action,
+                "file_id": file_hash
+            }
         }
+        for text, action in _LLM_BUTTONS
+        if action not in exclude_actions
     ]
 
-    # Filter out excluded actions and build keyboard
-    keyboard = []
-    for btn in all_buttons:
-        if btn["action"] not in exclude_actions:
-            keyboard.append({
-                "text": btn["text"],
-                "callback_data": {
-                    "action": btn["action"],
-                    "file_id": file_hash
-                }
-            })
-            logger.debug(f"Added button: {btn['text']} (action: {btn['action']})")
-        else:
-            logger.debug(f"Excluded button: {btn['text']} (action: {btn['action']})")
-
-    logger.info(f"Returning keyboard with {len(keyboard)} buttons")
+    # Lazy %-args: nothing is formatted unless DEBUG is enabled
+    logger.debug("LLM keyboard for %s: %d buttons, excluded: %s", file_hash, len(keyboard), exclude_actions)
     return keyboard
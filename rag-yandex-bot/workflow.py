@@ -3,6 +3,7 @@ File Processing Workflow
 Orchestrates audio extraction and speech recognition
 """
 import os
+import asyncio
 import logging
 import aiohttp
 from typing import Callable, Optional
@@ -10,8 +11,12 @@ from typing import Callable, Optional
 logger = logging.getLogger(__name__)
 
 # Supported formats
-VIDEO_FORMATS = ['.mp4', '.mkv', '.webm', '.avi', '.mov', '.m4v', '.flv']
-AUDIO_FORMATS = ['.mp3', '.wav', '.m4a', '.aac', '.opus', '.ogg', '.wma', '.flac']
+VIDEO_FORMATS = ('.mp4', '.mkv', '.webm', '.avi', '.mov', '.m4v', '.flv')
+AUDIO_FORMATS = ('.mp3', '.wav', '.m4a', '.aac', '.opus', '.ogg', '.wma', '.flac')
+
+# Extension -> file type, built once for O(1) lookups
+_EXT_TYPE = {ext: 'video' for ext in VIDEO_FORMATS}
+_EXT_TYPE.update({ext: 'audio' for ext in AUDIO_FORMATS})
 
 
 class FileProcessor:
@@ -29,6 +34,78 @@ class FileProcessor:
         """
         self.audio_extractor_url = audio_extractor_url
         self.speech_recognition_url = speech_recognition_url
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Last queued status update; each update waits for the previous one to keep them in order
+        self._status_task: Optional[asyncio.Task] = None
+        # Files to delete; a background worker unlinks them in a thread
+        self._gc_queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._gc_task: Optional[asyncio.Task] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Get or create aiohttp session shared by all pipeline stages"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0, limit_per_host=32, keepalive_timeout=75)
+            )
+        return self._session
+
+    async def close(self):
+        """Finish pending file cleanup and close session"""
+        if self._gc_task:
+            await self._gc_queue.join()
+            self._gc_task.cancel()
+            self._gc_task = None
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    def _discard(self, path: str):
+        """
+        Queue a file for deletion without blocking the event loop
+
+        Args:
+            path: Path to file to delete
+        """
+        if self._gc_task is None or self._gc_task.done():
+            self._gc_task = asyncio.create_task(self._gc_worker())
+        self._gc_queue.put_nowait(path)
+
+    async def _gc_worker(self):
+        """Delete queued files one by one in a worker thread"""
+        while True:
+            path = await self._gc_queue.get()
+            try:
+                await asyncio.to_thread(os.unlink, path)
+            except OSError as e:
+                logger.debug(f"Failed to delete {path}: {e}")
+            finally:
+                self._gc_queue.task_done()
+
+    def _notify(self, status_callback: Optional[Callable], status: str):
+        """
+        Send a status update in the background so it overlaps the pipeline I/O
+
+        Args:
+            status_callback: Callback for status updates
+            status: Status text
+        """
+        if not status_callback:
+            return
+        previous = self._status_task
+
+        async def send():
+            if previous:
+                await asyncio.wait([previous])
+            try:
+                await status_callback(status)
+            except Exception as e:
+                logger.warning(f"Status update failed: {e}")
+
+        self._status_task = asyncio.create_task(send())
+
+    async def _flush_status(self):
+        """Wait until all queued status updates are sent"""
+        if self._status_task:
+            await asyncio.wait([self._status_task])
 
     def get_file_type(self, filename: str) -> str:
         """
@@ -40,14 +117,7 @@ class FileProcessor:
         Returns:
             'video', 'audio', or 'unknown'
         """
-        ext = os.path.splitext(filename)[1].lower()
-
-        if ext in VIDEO_FORMATS:
-            return 'video'
-        elif ext in AUDIO_FORMATS:
-            return 'audio'
-        else:
-            return 'unknown'
+        return _EXT_TYPE.get(os.path.splitext(filename)[1].lower(), 'unknown')
 
     async def extract_audio(
         self,
@@ -66,38 +136,36 @@ class FileProcessor:
         """
         logger.info(f"Extracting audio from: {video_path}")
 
-        if status_callback:
-            await status_callback("🎬 Извлечение аудио из видео...")
+        self._notify(status_callback, "🎬 Извлечение аудио из видео...")
 
         try:
-            async with aiohttp.ClientSession() as session:
-                with open(video_path, 'rb') as f:
-                    form = aiohttp.FormData()
-                    form.add_field('file', f, filename=os.path.basename(video_path))
-
-                    async with session.post(
-                        f"{self.audio_extractor_url}/extract",
-                        data=form,
-                        timeout=aiohttp.ClientTimeout(total=600)
-                    ) as response:
-                        if response.status != 200:
-                            error_text = await response.text()
-                            logger.error(f"Audio extraction failed: {error_text}")
-                            return None
-
-                        result = await response.json()
-
-                        if result["status"] == "success":
-                            audio_path = result["output_path"]
-                            logger.info(f"Audio extracted: {audio_path}")
-
-                            if status_callback:
-                                await status_callback("✅ Аудио извлечено успешно")
-
-                            return audio_path
-                        else:
-                            logger.error("Audio extraction failed")
-                            return None
+            session = await self._get_session()
+            with open(video_path, 'rb') as f:
+                form = aiohttp.FormData()
+                form.add_field('file', f, filename=os.path.basename(video_path))
+
+                async with session.post(
+                    f"{self.audio_extractor_url}/extract",
+                    data=form,
+                    timeout=aiohttp.ClientTimeout(total=600)
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        logger.error(f"Audio extraction failed: {error_text}")
+                        return None
+
+                    result = await response.json()
+
+                    if result["status"] == "success":
+                        audio_path = result["output_path"]
+                        logger.info(f"Audio extracted: {audio_path}")
+
+                        self._notify(status_callback, "✅ Аудио извлечено успешно")
+
+                        return audio_path
+                    else:
+                        logger.error("Audio extraction failed")
+                        return None
 
         except Exception as e:
             logger.error(f"Error extracting audio: {e}", exc_info=True)
@@ -120,37 +188,35 @@ class FileProcessor:
         """
         logger.info(f"Recognizing speech from: {audio_path}")
 
-        if status_callback:
-            await status_callback("🎤 Распознавание речи (WhisperX + диаризация)...")
+        self._notify(status_callback, "🎤 Распознавание речи (WhisperX + диаризация)...")
 
         try:
-            async with aiohttp.ClientSession() as session:
-                with open(audio_path, 'rb') as f:
-                    form = aiohttp.FormData()
-                    form.add_field('file', f, filename=os.path.basename(audio_path))
-
-                    async with session.post(
-                        f"{self.speech_recognition_url}/recognize",
-                        data=form,
-                        timeout=aiohttp.ClientTimeout(total=1800)  # 30 min timeout
-                    ) as response:
-                        if response.status != 200:
-                            error_text = await response.text()
-                            logger.error(f"Speech recognition failed: {error_text}")
-                            return None
-
-                        result = await response.json()
-
-                        if result["status"] == "success":
-                            logger.info("Speech recognition completed")
-
-                            if status_callback:
-                                await status_callback("✅ Распознавание завершено")
-
-                            return result["result"]
-                        else:
-                            logger.error("Speech recognition failed")
-                            return None
+            session = await self._get_session()
+            with open(audio_path, 'rb') as f:
+                form = aiohttp.FormData()
+                form.add_field('file', f, filename=os.path.basename(audio_path))
+
+                async with session.post(
+                    f"{self.speech_recognition_url}/recognize",
+                    data=form,
+                    timeout=aiohttp.ClientTimeout(total=1800)  # 30 min timeout
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        logger.error(f"Speech recognition failed: {error_text}")
+                        return None
+
+                    result = await response.json()
+
+                    if result["status"] == "success":
+                        logger.info("Speech recognition completed")
+
+                        self._notify(status_callback, "✅ Распознавание завершено")
+
+                        return result["result"]
+                    else:
+                        logger.error("Speech recognition failed")
+                        return None
 
         except Exception as e:
             logger.error(f"Error recognizing speech: {e}", exc_info=True)
@@ -197,17 +263,13 @@ class FileProcessor:
                     }
 
                 # Clean up original video file
-                try:
-                    os.remove(file_path)
-                except:
-                    pass
+                self._discard(file_path)
 
             else:
                 # Audio file, use directly
                 audio_path = file_path
 
-                if status_callback:
-                    await status_callback("🎵 Аудио файл получен")
+                self._notify(status_callback, "🎵 Аудио файл получен")
 
             # Recognize speech
             result = await self.recognize_speech(audio_path, status_callback)
@@ -219,10 +281,7 @@ class FileProcessor:
                 }
 
             # Clean up audio file
-            try:
-                os.remove(audio_path)
-            except:
-                pass
+            self._discard(audio_path)
 
             return {
                 "status": "success",
@@ -235,3 +294,7 @@ class FileProcessor:
                 "status": "error",
                 "error": str(e)
             }
+
+        finally:
+            # Deliver progress updates before the caller reports the outcome
+            await self._flush_status()
@@ -5,6 +5,8 @@ Wrapper for Yandex Messenger Bot API
 import os
 import logging
 import aiohttp
+import aiofiles
+import orjson
 from typing import Optional, List, Dict
 
 logger = logging.getLogger(__name__)
@@ -12,6 +14,24 @@ logger = logging.getLogger(__name__)
 # Yandex Messenger API base URL
 API_BASE_URL = "https://botapi.messenger.yandex.net"
 
+# Full endpoint URLs, built once
+URL_GET_UPDATES = API_BASE_URL + "/bot/v1/messages/getUpdates/"
+URL_SEND_TEXT = API_BASE_URL + "/bot/v1/messages/sendText/"
+URL_SEND_FILE = API_BASE_URL + "/bot/v1/messages/sendFile/"
+URL_ANSWER_CALLBACK = API_BASE_URL + "/bot/v1/messages/answerCallbackQuery/"
+URL_GET_FILE = API_BASE_URL + "/bot/v1/messages/getFile/"
+URL_UPLOAD_FILE = API_BASE_URL + "/bot/v1/files/upload/"
+
+# Path separators are replaced in file_id before it becomes part of a file name
+_FILE_ID_SANITIZE = str.maketrans({"/": "_", "\\": "_"})
+
+# Long-poll timeout for getUpdates; idle keep-alive sockets must outlive it
+POLL_TIMEOUT = 60
+
+# Read size for file downloads; bodies up to the small-file limit are read and written in one go
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DOWNLOAD_SMALL_FILE_LIMIT = 2 << 20
+
 
 class YandexMessengerClient:
     """
@@ -33,7 +53,18 @@ class YandexMessengerClient:
     async def _get_session(self) -> aiohttp.ClientSession:
         """Get or create aiohttp session"""
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=100,
+                    limit_per_host=20,
+                    keepalive_timeout=max(120, POLL_TIMEOUT + 30),
+                    enable_cleanup_closed=True,
+                    ttl_dns_cache=300
+                ),
+                headers={"Authorization": f"OAuth {self.bot_token}"},
+                # aiohttp expects a str from json_serialize
+                json_serialize=lambda obj: orjson.dumps(obj).decode()
+            )
         return self.session
 
     async def close(self):
@@ -44,7 +75,7 @@ class YandexMessengerClient:
     async def _make_request(
         self,
         method: str,
-        endpoint: str,
+        url: str,
         **kwargs
     ) -> Optional[dict]:
         """
@@ -52,36 +83,31 @@ class YandexMessengerClient:
 
         Args:
             method: HTTP method (GET, POST)
-            endpoint: API endpoint
+            url: Full endpoint URL
             **kwargs: Additional request parameters
 
         Returns:
             Response JSON or None on error
         """
-        url = f"{API_BASE_URL}{endpoint}"
-        headers = kwargs.pop("headers", {})
-        headers["Authorization"] = f"OAuth {self.bot_token}"
-
+        # Authorization comes from the session's default headers
         session = await self._get_session()
 
         try:
-            async with session.request(method, url, headers=headers, **kwargs) as response:
+            async with session.request(method, url, **kwargs) as response:
                 if response.status == 200:
-                    # Try to parse as JSON
+                    # If not JSON, return empty dict without paying for a failed parse
+                    if response.content_type != "application/json":
+                        return {}
                     try:
-                        return await response.json()
-                    except:
-                        # If not JSON, return empty dict
+                        return orjson.loads(await response.read())
+                    except orjson.JSONDecodeError:
                         return {}
                 else:
-                    # Read error response as text
-                    try:
-                        response_text = await response.text()
-                    except:
-                        response_text = "<unable to decode response>"
+                    # Read error response as text; undecodable bytes are replaced instead of raising
+                    response_text = await response.text(errors="replace")
 
                     logger.error(
-                        f"API request failed: {method} {endpoint} - "
+                        f"API request failed: {method} {url} - "
                         f"Status: {response.status}, Response: {response_text}"
                     )
                     return None
@@ -97,15 +123,15 @@ class YandexMessengerClient:
         Returns:
             bool: True if connection successful
         """
-        # Try to get updates (simple API call)
-        result = await self.get_updates(limit=1)
+        # Try to get updates (simple API call); timeout=0 so the server answers without long polling
+        result = await self.get_updates(limit=1, timeout=0)
         return result is not None
 
     async def get_updates(
         self,
         offset: int = 0,
         limit: int = 100,
-        timeout: int = 60
+        timeout: int = POLL_TIMEOUT
     ) -> Optional[List[Dict]]:
         """
         Get bot updates (long polling)
@@ -126,7 +152,7 @@ class YandexMessengerClient:
 
         response = await self._make_request(
             "GET",
-            "/bot/v1/messages/getUpdates/",
+            URL_GET_UPDATES,
             params=params,
             timeout=aiohttp.ClientTimeout(total=timeout + 10)
         )
@@ -153,25 +179,13 @@ class YandexMessengerClient:
         Returns:
             Response dict with message info or None on error
         """
-        import json as json_module
-
         logger.info(f"Sending message to {chat_id}: {text[:50]}...")
 
         # For private chats, Yandex API requires 'login' field instead of 'chat_id'
         # Login format: email (e.g., "user@domain.ru")
         # Group chat_id format: numeric or special format
-        if "@" in chat_id:
-            # Private chat - use login
-            payload = {
-                "login": chat_id,
-                "text": text
-            }
-        else:
-            # Group chat - use chat_id
-            payload = {
-                "chat_id": chat_id,
-                "text": text
-            }
+        key = "login" if "@" in chat_id else "chat_id"
+        payload = {key: chat_id, "text": text}
 
         # Add inline keyboard if provided
         if inline_keyboard:
@@ -179,17 +193,13 @@ class YandexMessengerClient:
             # Flatten if needed (single row of buttons)
             payload["inline_keyboard"] = inline_keyboard
 
-            # DEBUG: Log the payload to verify JSON structure
-            try:
-                json_str = json_module.dumps(payload, ensure_ascii=False, indent=2)
-                logger.debug(f"Payload with inline_keyboard:\n{json_str}")
-            except Exception as e:
-                logger.error(f"Failed to serialize payload to JSON: {e}")
-                return None
+            # DEBUG: Log the payload to verify JSON structure (serialized only when DEBUG is on)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Payload with inline_keyboard:\n%s", orjson.dumps(payload).decode())
 
         response = await self._make_request(
             "POST",
-            "/bot/v1/messages/sendText/",
+            URL_SEND_TEXT,
             json=payload
         )
 
@@ -229,7 +239,7 @@ class YandexMessengerClient:
 
         response = await self._make_request(
             "POST",
-            "/bot/v1/messages/answerCallbackQuery/",
+            URL_ANSWER_CALLBACK,
             json=payload
         )
 
@@ -258,16 +268,11 @@ class YandexMessengerClient:
 
         try:
             payload = {"file_id": file_id}
-            headers = {
-                "Authorization": f"OAuth {self.bot_token}",
-                "Content-Type": "application/json"
-            }
 
             logger.info(f"Requesting file via POST application/json, file_id={file_id}")
 
             async with session.post(
-                f"{API_BASE_URL}/bot/v1/messages/getFile/",
-                headers=headers,
+                URL_GET_FILE,
                 json=payload
             ) as response:
                 if response.status != 200:
@@ -276,15 +281,17 @@ class YandexMessengerClient:
                     return None
 
                 # Save file (sanitize file_id to remove slashes)
-                safe_file_id = file_id.replace("/", "_").replace("\\", "_")
+                safe_file_id = file_id.translate(_FILE_ID_SANITIZE)
                 file_path = os.path.join(self.upload_dir, f"{safe_file_id}_{file_name}")
 
-                with open(file_path, "wb") as f:
-                    while True:
-                        chunk = await response.content.read(8192)
-                        if not chunk:
-                            break
-                        f.write(chunk)
+                # Writes go through aiofiles' thread pool so disk I/O doesn't stall the event loop
+                async with aiofiles.open(file_path, "wb") as f:
+                    size = response.content_length
+                    if size is not None and size <= DOWNLOAD_SMALL_FILE_LIMIT:
+                        await f.write(await response.read())
+                    else:
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            await f.write(chunk)
 
                 logger.info(f"File downloaded: {file_path}")
                 return file_path
@@ -320,18 +327,15 @@ class YandexMessengerClient:
                 form = aiohttp.FormData()
                 form.add_field("file", f, filename=os.path.basename(file_path))
 
-                headers = {"Authorization": f"OAuth {self.bot_token}"}
-
                 async with session.post(
-                    f"{API_BASE_URL}/bot/v1/files/upload/",
-                    headers=headers,
+                    URL_UPLOAD_FILE,
                     data=form
                 ) as response:
                     if response.status != 200:
                         logger.error(f"Failed to upload file: {response.status}")
                         return False
 
-                    upload_response = await response.json()
+                    upload_response = await response.json(loads=orjson.loads)
                     file_id = upload_response.get("file_id")
 
                     if not file_id:
@@ -349,7 +353,7 @@ class YandexMessengerClient:
 
             response = await self._make_request(
                 "POST",
-                "/bot/v1/messages/sendFile/",
+                URL_SEND_FILE,
                 json=payload
             )
 